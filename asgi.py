@@ -0,0 +1,147 @@
+#! /usr/bin/python3
+# (c) Copyright 2019-2020, James Stevens ... see LICENSE for details
+# Alternative license arrangements possible, contact me for more information
+""" ASGI entry point, e.g. `uvicorn asgi:application`, that runs each request
+    on a large pool of threads, so one process can have as many requests
+    waiting on MySQL at once as it has connections """
+
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+def default_env(name, value):
+    """ set environment variable {name} to {value}, if it is not set """
+    if os.environ.get(name, "") == "":
+        os.environ[name] = str(value)
+
+
+default_env("AUTO_SQL_POOL_SIZE", 64)
+default_env("AUTO_SQL_ASGI_THREADS", os.environ["AUTO_SQL_POOL_SIZE"])
+default_env("AUTO_SQL_JOIN_THREADS", 8)
+
+import auto_sql  # pylint: disable=wrong-import-position
+
+workers = ThreadPoolExecutor(
+    max_workers=int(os.environ["AUTO_SQL_ASGI_THREADS"]))
+
+
+def wsgi_environ(scope, body):
+    """ WSGI environ for the ASGI http {scope} with request {body} """
+    server = scope.get("server", None) or ("localhost", 80)
+    client = scope.get("client", None) or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME":
+        scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False
+    }
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name == "CONTENT_LENGTH":
+            continue
+        if name != "CONTENT_TYPE":
+            name = "HTTP_" + name
+        if name in environ:
+            value = environ[name] + "," + value
+        environ[name] = value
+
+    return environ
+
+
+def run_request(loop, environ, send):
+    """ run the app for {environ} in this thread, passing the response
+        back to {send} on the event {loop} """
+    def send_now(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    reply = {}
+
+    def start_response(status, headers, exc_info=None):
+        del exc_info
+        reply["status"] = int(status.split(" ")[0])
+        reply["headers"] = [(name.lower().encode("latin1"),
+                             value.encode("latin1"))
+                            for name, value in headers]
+        return lambda data: send_now({
+            "type": "http.response.body",
+            "body": data,
+            "more_body": True
+        })
+
+    result = auto_sql.application(environ, start_response)
+    try:
+        send_now({
+            "type": "http.response.start",
+            "status": reply["status"],
+            "headers": reply["headers"]
+        })
+        for data in result:
+            if len(data) > 0:
+                send_now({
+                    "type": "http.response.body",
+                    "body": data,
+                    "more_body": True
+                })
+        send_now({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+
+async def read_body(receive):
+    """ the whole request body """
+    body = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(body)
+
+
+async def lifespan(receive, send):
+    """ answer the server's startup & shutdown messages """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            auto_sql.pool.close_all()
+            if auto_sql.replicas is not None:
+                auto_sql.replicas.close_all()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """ ASGI application serving the same routes as `wsgi.py` """
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    body = await read_body(receive)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(workers, run_request, loop,
+                               wsgi_environ(scope, body), send)
@@ -1,24 +1,59 @@
 #! /usr/bin/python3
 """ provide a rest/api to a MySQL Database using Flask """
 
+import base64
+import binascii
+import contextlib
+import functools
+import hashlib
 import json
 import os
 import sys
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
 from MySQLdb import _mysql
 from MySQLdb.constants import FIELD_TYPE
 import MySQLdb.converters
 import flask
 
 import mysql_schema
+import mysql_pool
+import mysql_replicas
+import row_shapes
+import result_cache
+import join_cache
+import serialise
+import metrics
+import log_queue
+import query_shapes
+import table_versions
+import single_flight
 
 MYSQL_ENV = [
     "MYSQL_USERNAME", "MYSQL_PASSWORD", "MYSQL_CONNECT", "MYSQL_DATABASE"
 ]
 ASKS = ["=", "!=", "<>", "<", ">", ">=", "<=", "like", "regexp"]
+AGGREGATES = ["count", "sum", "min", "max", "avg"]
+PLAIN_INT = {"is_plain_int": True, "type": "int"}
+QUERY_SHAPE_ITEMS = ["by", "order", "columns"]
+SELECT_MODIFIERS = [
+    "where", "limit", "skip", "by", "order", "join", "join-basic", "stream",
+    "after", "columns", "format"
+]
 
 schema = {}
-cnx = None
+shapes = {}
+typed_shapes = {}
+pool = None
+replicas = None
+results = None
+lookups = None
+templates = None
+versions = None
+flights = None
+schema_hash = ""
+join_workers = None
+monitor = None
 
 
 def convert_string(data):
@@ -28,11 +63,11 @@ def convert_string(data):
     return data
 
 
-def connect_to_mysql():
-    """ Connect to the database """
+def connect_to_mysql(conn=None):
+    """ Connect to the database at {conn}, or `MYSQL_CONNECT` """
     for var in MYSQL_ENV:
         if var not in os.environ or os.environ[var] == "":
-            print(f"ERROR: Environment variable '{var}' is missing")
+            log_queue.error(f"Environment variable '{var}' is missing")
             return None
 
     my_conv = MySQLdb.converters.conversions.copy()
@@ -43,8 +78,9 @@ def connect_to_mysql():
     sock = "/tmp/mysql.sock"
     host = None
     port = None
-    if "MYSQL_CONNECT" in os.environ:
-        conn = os.environ["MYSQL_CONNECT"]
+    if conn is None:
+        conn = os.environ.get("MYSQL_CONNECT", None)
+    if conn is not None:
         if conn[0] == "/":
             sock = conn
         else:
@@ -76,9 +112,12 @@ def json_abort(status_code, message):
     else:
         data["error"]["message"] = message
 
-    response = flask.jsonify(data)
-    response.status_code = status_code
-    flask.abort(response)
+    mimetype = "application/json"
+    if flask.has_request_context():
+        mimetype = reply_mimetype()
+    flask.abort(
+        make_response(status_code,
+                      serialise.FORMATS[mimetype]["dumps"](data), mimetype))
 
 
 def find_best_index(idxes):
@@ -96,14 +135,17 @@ def find_best_index(idxes):
 
 
 def add_data(data, this_col):
-    """ convert {data} to SQL string """
+    """ convert {data} to SQL string, quoted & escaped by the MySQL driver """
+    if "slots" in flask.g:
+        flask.g.slots.append(this_col)
+        return query_shapes.SLOT
     if this_col["is_plain_int"]:
         return str(int(data))
     if this_col["type"] == "boolean":
         return "1" if data else "0"
     if not isinstance(data, str):
         data = str(data)
-    return "unhex('" + "".join([hex(ord(a))[2:] for a in data]) + "')"
+    return db_cnx().string_literal(data.encode("utf8")).decode("utf8")
 
 
 def clean_list_string(data):
@@ -115,43 +157,24 @@ def clean_list_string(data):
     return [data]
 
 
+def table_shape(table):
+    """ compiled row shape of {table} for the format being replied in """
+    if serialise.FORMATS[reply_mimetype()]["typed"]:
+        return typed_shapes[table]
+    return shapes[table]
+
+
 def prepare_row_data(rows, table):
-    """ format {rows} from {table} for JSON output """
-    for row in rows:
-        for col in [r for r in row]:
-            if row[col] is None:
-                del row[col]
-            else:
-                row[col] = clean_col_data(row[col], table, col)
-                if ("enums" in schema[":more:"]
-                        and col in schema[":more:"]["enums"]
-                        and row[col] in schema[":more:"]["enums"][col]):
-                    row[col] = {
-                        ":value:": row[col],
-                        ":text:": schema[":more:"]["enums"][col][row[col]]
-                    }
+    """ format {rows} from {table} for output """
+    with timed("shape"):
+        row_shapes.shape_rows(rows, table_shape(table))
 
 
 def clean_col_data(data, table, column):
     """ JSON format {data} from {table}.{column} """
     if data is None or column[0] == ":":
         return data
-
-    ret = data
-    this_col = schema[table]["columns"][column]
-
-    if this_col["type"] == "boolean":
-        ret = int(data) != 0
-    elif this_col["type"] == "decimal":
-        ret = float(data)
-    elif this_col["is_plain_int"]:
-        ret = int(data)
-    elif isinstance(data, datetime):
-        ret = data.strftime('%Y-%m-%d %H:%M:%S')
-    elif not isinstance(data, str):
-        ret = str(data)
-
-    return ret
+    return shapes[table][column][0](data)
 
 
 def find_join_column(src_table, dst_table):
@@ -213,8 +236,10 @@ def each_where_obj(sql_joins, table, ask_item, where_obj):
     for where_itm in where_obj:
         tbl = table
         col = where_itm
+        sql_col = table + "." + col
         if where_itm.find(".") >= 0:
             col, tbl = find_foreign_column(sql_joins, table, col)
+            sql_col = col
         elif col not in schema[table]["columns"]:
             json_abort(400, f"Column `{col}` is not in table `{table}`")
 
@@ -223,14 +248,14 @@ def each_where_obj(sql_joins, table, ask_item, where_obj):
                 json_abort(400, f"Column `{col}` is not in table `{table}`")
             this_col = schema[tbl]["columns"][col]
             where.append(
-                "(" + where_itm + " in (" +
+                "(" + sql_col + " in (" +
                 ",".join([add_data(d, this_col)
                           for d in where_obj[where_itm]]) + ") )")
         else:
             clause = []
             for itm in clean_list_string(where_obj[where_itm]):
                 only_col = col if col.find(".") < 0 else col.split(".")[1]
-                clause.append(col + ask_item +
+                clause.append(sql_col + ask_item +
                               add_data(itm, schema[tbl]["columns"][only_col]))
 
             where.append("(" + " or ".join(clause) + ")")
@@ -238,22 +263,73 @@ def each_where_obj(sql_joins, table, ask_item, where_obj):
     return " and ".join(where) if len(where) > 0 else ""
 
 
+def where_conditions(sql_joins, table, sent):
+    """ convert the `where` JSON in {sent} into SQL conditions """
+    where = []
+    for ask_item in sent["where"]:
+        if ask_item not in ASKS:
+            json_abort(400, f"Comparison `{ask_item}` not supported")
+        clause = each_where_obj(sql_joins, table, ask_item,
+                                sent["where"][ask_item])
+        if len(clause) > 0:
+            where.append(clause)
+
+    return " and ".join(where)
+
+
+def filter_columns(table, sent):
+    """ columns of {table} that the `where`, or else `order`, in {sent}
+        filters on, in a way an index could help with """
+    cols = []
+    if "where" in sent and not isinstance(sent["where"], str):
+        for ask_item in sent["where"]:
+            if ask_item in ("!=", "<>", "regexp"):
+                continue
+            for col in sent["where"][ask_item]:
+                if col in schema[table]["columns"] and col not in cols:
+                    cols.append(col)
+    if len(cols) <= 0 and "order" in sent:
+        col = clean_list_string(sent["order"])[0].split(" ")[0]
+        if col in schema[table]["columns"]:
+            cols.append(col)
+    return cols
+
+
+def check_indexed(table, sent):
+    """ warn about, or reject, filtering {table} in a way no index helps """
+    check = os.environ.get("AUTO_SQL_UNINDEXED", "warn")
+    if check not in ("warn", "reject"):
+        return
+
+    cols = filter_columns(table, sent)
+    if len(cols) <= 0:
+        return
+
+    leading = [
+        this_idx["columns"][0]
+        for this_idx in schema[table]["indexes"].values()
+    ]
+    if any(col in leading for col in cols):
+        return
+
+    message = f"No index of table `{table}` starts with " + ", ".join(
+        [f"`{col}`" for col in cols])
+    monitor.count("auto_sql_unindexed_total", table=table)
+    if check == "reject":
+        json_abort(400, message)
+    log_queue.warning(message)
+
+
 def where_clause(table, sent):
     """ convert the {where_data} JSON into SQL """
     if "where" not in sent:
         return ""
 
-    sql_joins = {}
-
     if isinstance(sent["where"], str):
         return sent["where"]
 
-    if isinstance(sent["where"], object):
-        for ask_item in sent["where"]:
-            if ask_item not in ASKS:
-                json_abort(400, f"Comparison `{ask_item}` not supported")
-            where = each_where_obj(sql_joins, table, ask_item,
-                                   sent["where"][ask_item])
+    sql_joins = {}
+    where = where_conditions(sql_joins, table, sent)
 
     return " ".join([sql_joins[x]
                      for x in sql_joins]) + (" where " +
@@ -273,16 +349,16 @@ def plain_value(data):
 
 def include_for_join(data):
     """ shall we retrieve this foreign record """
-    if data is None:
+    if data is None or isinstance(data, dict):
         return False
     if isinstance(data, str) and data == "":
         return False
     return True
 
 
-def mysql_abort(exc, state):
+def mysql_abort(exc, state, status_code=400):
     """ abort on MySQL exception {exc} at {state} """
-    json_abort(400, {
+    json_abort(status_code, {
         "mysql": {
             "code": exc.args[0],
             "message": exc.args[1],
@@ -291,22 +367,123 @@ def mysql_abort(exc, state):
     })
 
 
+def db_cnx():
+    """ MySQL connection for this request, taken from the pool """
+    if "cnx" not in flask.g:
+        try:
+            flask.g.cnx = request_pool().acquire()
+        except mysql_pool.PoolTimeout as exc:
+            mysql_abort(exc, "C", 503)
+        except MySQLdb.Error as exc:
+            if "read_pool" not in flask.g:
+                mysql_abort(exc, "C", 503)
+            replicas.failed(flask.g.pop("read_pool"))
+            return db_cnx()
+    return flask.g.cnx
+
+
+def request_pool():
+    """ the pool this request's MySQL connection comes from """
+    return flask.g.get("read_pool", pool)
+
+
+def use_replica(tables):
+    """ read from a replica for the rest of this request, unless one of
+        {tables} has been written to too recently for it to have caught up """
+    if replicas is None or "cnx" in flask.g or "transaction" in flask.g:
+        return
+    pinned = time.time() - env_int(
+        "AUTO_SQL_REPLICA_PIN",
+        replicas.max_lag + replicas.check_every)
+    for table in [":schema:"] + tables:
+        if versions.changed_at(table) > pinned:
+            monitor.count("auto_sql_replica_pinned_total")
+            return
+    read_pool = replicas.pick()
+    if read_pool is not None:
+        flask.g.read_pool = read_pool
+
+
+def timed(phase):
+    """ time the block as the {phase} part of handling a request """
+    return monitor.timer("auto_sql_phase_seconds", phase=phase)
+
+
 def run_query(sql):
     """ run the {sql}, reconnecting to MySQL, if necessary """
-    global cnx
-    print(">>>>>>", sql)
+    log_queue.sql(sql)
+    note_slow_rows()
+    start = time.perf_counter()
+    with timed("execute"):
+        query_once_more(sql)
+
+    secs = time.perf_counter() - start
+    slow_ms = env_int("AUTO_SQL_SLOW_QUERY_MS", 1000)
+    if 0 < slow_ms <= secs * 1000:
+        if "slow" not in flask.g:
+            flask.g.slow = []
+        flask.g.slow.append({
+            "sql": sql,
+            "secs": secs,
+            "rows": None,
+            "cnx": flask.g.cnx
+        })
+
+
+def note_slow_rows():
+    """ save the row count of the last slow query, once it has been read """
+    if "slow" not in flask.g or flask.g.slow[-1]["rows"] is not None:
+        return
+    if flask.g.get("cnx", None) is flask.g.slow[-1]["cnx"]:
+        flask.g.slow[-1]["rows"] = flask.g.cnx.affected_rows()
+
+
+def explain_query(sql):
+    """ MySQL's `explain` of {sql}, or None if it can not be explained """
+    if "cnx" not in flask.g or sql.split(" ")[0].lower() not in ("select",
+                                                                 "update",
+                                                                 "delete"):
+        return None
+    try:
+        flask.g.cnx.query("explain " + sql)
+        res = flask.g.cnx.store_result()
+        return [r for r in res.fetch_row(maxrows=0, how=1)]
+    except MySQLdb.Error:
+        return None
+
+
+def log_slow_queries():
+    """ log the slow queries in this request, with how MySQL ran them """
+    note_slow_rows()
+    for query in flask.g.pop("slow"):
+        log_queue.warning("Slow query",
+                          secs=f"{query['secs']:.3f}",
+                          rows="?" if query["rows"] is None else query["rows"],
+                          sql=log_queue.cut_sql(query["sql"]))
+        monitor.count("auto_sql_slow_queries_total")
+        if flask.g.get("cnx", None) is query["cnx"]:
+            plan = explain_query(query["sql"])
+            if plan is not None:
+                log_queue.warning(
+                    "Slow query plan",
+                    explain=serialise.json_dumps(plan).decode("utf8"))
+
+
+def query_once_more(sql):
+    """ run the {sql}, retrying once if the connection has failed """
     try:
-        cnx.query(sql)
+        db_cnx().query(sql)
 
     except MySQLdb.OperationalError as exc:
-        cnx.close()
-        make_connection()
+        request_pool().discard(flask.g.pop("cnx"))
+        if "transaction" in flask.g:
+            mysql_abort(exc, "A")
+        flask.g.pop("read_pool", None)
         try:
-            cnx.query(sql)
+            db_cnx().query(sql)
         except MySQLdb.OperationalError as exc:
+            pool.discard(flask.g.pop("cnx"))
             mysql_abort(exc, "A")
-            cnx.close()
-            cnx = None
         except MySQLdb.Error as exc:
             mysql_abort(exc, "B")
 
@@ -314,35 +491,150 @@ def run_query(sql):
         mysql_abort(exc, "B")
 
 
-def load_all_joins(need):
-    """ Load all db data for joins {need}ed """
+def load_all_joins(need, wanted):
+    """ Load all db data for joins {need}ed, only {wanted} columns """
     join_data = {}
+    batch = env_int("AUTO_SQL_JOIN_BATCH", 1000)
+    batches = []
     for item in need:
         src = item.split(".")
-        sql = "select * from " + src[0] + " where " + item + " in ("
-
-        this_col = schema[src[0]]["columns"][src[1]]
-
-        clauses = [add_data(d, this_col) for d in need[item]]
-
-        if len(clauses) <= 0:
+        cached = cached_join_rows(src[0], src[1], need[item], wanted[item])
+        if cached is not None:
+            join_data[item] = cached
             continue
 
-        sql = sql + ",".join(clauses) + ")"
-        run_query(sql)
+        select = "*"
+        if wanted[item] is not None:
+            select = ",".join(wanted[item])
 
-        res = cnx.store_result()
-        ret = res.fetch_row(maxrows=0, how=1)
+        this_col = schema[src[0]]["columns"][src[1]]
+        keys = list(need[item])
+        for pos in range(0, len(keys), batch):
+            clauses = [add_data(d, this_col) for d in keys[pos:pos + batch]]
+            batches.append(
+                (item, "select " + select + " from " + src[0] + " where " +
+                 item + " in (" + ",".join(clauses) + ")"))
+
+    for (item, __), ret in zip(batches,
+                               run_join_batches([b[1] for b in batches])):
+        src = item.split(".")
         prepare_row_data(ret, src[0])
-
-        join_data[item] = {
+        if item not in join_data:
+            join_data[item] = {}
+        join_data[item].update({
             clean_col_data(cols[src[1]], src[0], src[1]): cols
             for cols in ret if src[1] in cols
-        }
+        })
 
     return join_data
 
 
+def fetch_join_batch(sql):
+    """ run join {sql} on this request's connection & return the rows """
+    run_query(sql)
+    res = db_cnx().store_result()
+    return [r for r in res.fetch_row(maxrows=0, how=1)]
+
+
+def fetch_join_batches(from_pool, cnx, sqls):
+    """ run join {sqls} on {cnx}, then give it back to {from_pool} """
+    ret = []
+    try:
+        for sql in sqls:
+            log_queue.sql(sql)
+            cnx.query(sql)
+            res = cnx.store_result()
+            ret.append([r for r in res.fetch_row(maxrows=0, how=1)])
+    except MySQLdb.OperationalError:
+        from_pool.discard(cnx)
+        raise
+    except BaseException:
+        from_pool.release(cnx)
+        raise
+    from_pool.release(cnx)
+    return ret
+
+
+def spare_connections(from_pool, most):
+    """ up to {most} connections from {from_pool} that are free right now """
+    cnxs = []
+    while len(cnxs) < most:
+        try:
+            cnxs.append(from_pool.acquire(wait=0))
+        except MySQLdb.Error:
+            break
+    return cnxs
+
+
+def run_join_batches(sqls):
+    """ run all the join {sqls}, sharing them between this request's
+        connection & any others free right now, if configured to """
+    if join_workers is None or len(sqls) <= 1 or "transaction" in flask.g:
+        return [fetch_join_batch(sql) for sql in sqls]
+
+    db_cnx()
+    from_pool = request_pool()
+    cnxs = spare_connections(from_pool, len(sqls) - 1)
+    if len(cnxs) <= 0:
+        return [fetch_join_batch(sql) for sql in sqls]
+
+    ways = len(cnxs) + 1
+    futures = [
+        join_workers.submit(fetch_join_batches, from_pool, cnx,
+                            sqls[pos::ways])
+        for pos, cnx in enumerate(cnxs, start=1)
+    ]
+    shares = [[fetch_join_batch(sql) for sql in sqls[0::ways]]]
+    try:
+        shares.extend([future.result() for future in futures])
+    except MySQLdb.Error as exc:
+        mysql_abort(exc, "B")
+
+    return [shares[pos % ways][pos // ways] for pos in range(len(sqls))]
+
+
+def join_version(table):
+    """ version of {table} its join cache rows must have been read at """
+    version = versions.version(table)
+    secs = env_int("AUTO_SQL_ETAG_MYSQL_SECS", 0)
+    if secs > 0 and flask.has_request_context():
+        version += ":" + str(
+            versions.mysql_times([table], secs, read_update_times)[0])
+    return version
+
+
+def read_join_cache(cnx, table):
+    """ load all of {table} into the join cache, using {cnx} """
+    version = join_version(table)
+    cnx.query(f"select * from {table} limit {lookups.max_rows + 1}")
+    res = cnx.store_result()
+    lookups.store(table, [r for r in res.fetch_row(maxrows=0, how=1)],
+                  version)
+
+
+def preload_join_cache(cnx):
+    """ load all the join cache tables, using {cnx} """
+    for table in lookups.tables:
+        read_join_cache(cnx, table)
+
+
+def cached_join_rows(table, column, keys, wanted):
+    """ rows for {table.column} in {keys} from the join cache, or None """
+    if not lookups.wanted(table) or table in flask.g.get("transaction", ()):
+        return None
+    if lookups.stale(table, join_version(table)):
+        try:
+            read_join_cache(db_cnx(), table)
+        except MySQLdb.Error:
+            return None
+    found = lookups.lookup(table, column, keys, wanted)
+    if found is None:
+        return None
+    rows = list(found.values())
+    prepare_row_data(rows, table)
+    return dict(zip(found, rows))
+
+
 def join_this_column(table, col, which):
     """ do we want join data for this {table.col} """
 
@@ -359,7 +651,31 @@ def join_this_column(table, col, which):
     return None
 
 
-def handle_joins(rows, which, basic_format):
+def joined_columns(rows, which, projections):
+    """ columns to retrieve for each join target, None for all of them """
+    wanted = {}
+    for table in rows:
+        for col in schema[table]["columns"]:
+            target = join_this_column(table, col, which)
+            if target is None:
+                continue
+            if col not in projections or wanted.get(target, []) is None:
+                wanted[target] = None
+                continue
+
+            dst = target.split(".")
+            if target not in wanted:
+                wanted[target] = [dst[1]]
+            for dst_col in projections[col]:
+                if dst_col not in schema[dst[0]]["columns"]:
+                    json_abort(
+                        400, f"Column `{dst_col}` is not in table `{dst[0]}`")
+                if dst_col not in wanted[target]:
+                    wanted[target].append(dst_col)
+    return wanted
+
+
+def handle_joins(rows, which, basic_format, projections=None):
     """ retrive foreign rows & merge into return {rows} """
     if ":more:" not in schema or "joins" not in schema[":more:"]:
         return
@@ -380,15 +696,15 @@ def handle_joins(rows, which, basic_format):
                     continue
 
                 if target not in need:
-                    need[target] = []
+                    need[target] = {}
 
-                if cols[col] not in need[target]:
-                    need[target].append(cols[col])
+                need[target][cols[col]] = True
 
     if len(need) <= 0:
         return
 
-    join_data = load_all_joins(need)
+    join_data = load_all_joins(
+        need, joined_columns(rows, which, projections or {}))
     if basic_format:
         rows.update(join_data)
     else:
@@ -412,8 +728,11 @@ def add_join_data(rows, join_data, which):
                         cols[col][":join:"] = target
 
 
-def make_insert_from_list(set_list, table):
-    """ make multiline sql insert to {table} from {set_list} """
+def insert_values(set_list, table):
+    """ columns & sql `values` of each row in {set_list} for {table} """
+    if len(set_list) <= 0:
+        json_abort(400, "In an INSERT, the `set` list must not be empty")
+
     cols = schema[table]["columns"]
     have_cols = []
     for this_set in set_list:
@@ -427,8 +746,7 @@ def make_insert_from_list(set_list, table):
             if col not in have_cols:
                 have_cols.append(col)
 
-    sep = " "
-    sql = f"insert into {table}(" + ",".join(have_cols) + ") values"
+    values = []
     for this_set in set_list:
         vals = []
         for col in have_cols:
@@ -436,15 +754,119 @@ def make_insert_from_list(set_list, table):
                 vals.append(add_data(this_set[col], cols[col]))
             else:
                 vals.append("NULL")
-        sql = sql + sep + "(" + ",".join(vals) + ")"
-        sep = ","
+        values.append("(" + ",".join(vals) + ")")
+
+    return have_cols, values
 
-    return sql
+
+def on_duplicate_update(table, have_cols):
+    """ `on duplicate key update` sql to insert {have_cols} to {table} """
+    keys = [
+        this_idx["columns"] for this_idx in schema[table]["indexes"].values()
+        if this_idx.get("unique", False)
+    ]
+    keys = [idx_cols for idx_cols in keys
+            if all(col in have_cols for col in idx_cols)]
+    if len(keys) <= 0:
+        json_abort(
+            400, f"`on-duplicate` needs all the columns of a unique index "
+            f"of table `{table}` in the `set`")
+
+    key_cols = [col for idx_cols in keys for col in idx_cols]
+    update = [
+        f"{col}=values({col})" for col in have_cols if col not in key_cols
+    ]
+    if len(update) <= 0:
+        update = [f"{key_cols[0]}={key_cols[0]}"]
+    return " on duplicate key update " + ",".join(update)
+
+
+def make_insert_from_list(set_list, table, sent):
+    """ make multiline sql inserts to {table} from {set_list}, each
+        no bigger than `AUTO_SQL_INSERT_BYTES` """
+    have_cols, values = insert_values(set_list, table)
+
+    verb = "insert"
+    end = ""
+    if sent.get("on-duplicate", None) == "ignore":
+        verb = "insert ignore"
+    elif sent.get("on-duplicate", None) == "update":
+        end = on_duplicate_update(table, have_cols)
+    start = f"{verb} into {table}(" + ",".join(have_cols) + ") values "
+
+    max_bytes = env_int("AUTO_SQL_INSERT_BYTES", 1024 * 1024)
+    sqls = []
+    chunk = []
+    size = len(start) + len(end)
+    for vals in values:
+        this_size = len(vals.encode("utf8")) + 1
+        if len(chunk) > 0 and size + this_size > max_bytes:
+            sqls.append(start + ",".join(chunk) + end)
+            chunk = []
+            size = len(start) + len(end)
+        chunk.append(vals)
+        size += this_size
+    sqls.append(start + ",".join(chunk) + end)
+
+    return sqls
+
+
+def reply_mimetype():
+    """ mime type to reply with, picked from the `Accept` header """
+    if "mimetype" not in flask.g:
+        flask.g.mimetype = serialise.negotiate(flask.request.accept_mimetypes)
+    return flask.g.mimetype
+
+
+def make_response(val, body, mimetype):
+    """ response with code {val} of serialised {body} of type {mimetype} """
+    response = flask.Response(body, status=val, mimetype=mimetype)
+    response.vary.add("Accept")
+    return response
+
+
+def reply_body(reason):
+    """ serialise object {reason} in the format to reply with """
+    with timed("serialise"):
+        return serialise.FORMATS[reply_mimetype()]["dumps"](reason)
 
 
 def retmsg(val, reason):
     """ return object {reason} with code {val} """
-    return json.dumps(reason), val
+    return make_response(val, reply_body(reason), reply_mimetype())
+
+
+def rollback_transaction():
+    """ roll back this request's transaction, if it has a connection """
+    if "cnx" not in flask.g:
+        return
+    try:
+        flask.g.cnx.query("rollback")
+    except MySQLdb.Error:
+        request_pool().discard(flask.g.pop("cnx"))
+
+
+@contextlib.contextmanager
+def transaction():
+    """ run the block in a MySQL transaction, unless one is already open,
+        tables written to are only invalidated once it is committed """
+    if "transaction" in flask.g:
+        yield
+        return
+
+    run_query("start transaction")
+    flask.g.transaction = set()
+    try:
+        yield
+        run_query("commit")
+    except BaseException:
+        rollback_transaction()
+        raise
+    finally:
+        changed = flask.g.pop("transaction")
+
+    for table in changed:
+        table_changed(table)
 
 
 def unique_id(best_idx, row):
@@ -452,16 +874,340 @@ def unique_id(best_idx, row):
     return "|".join([plain_value(row[idx]) for idx in best_idx])
 
 
-def make_connection():
-    """ re/connect to MySQL """
+def env_int(name, default):
+    """ integer value of environment variable {name}, or {default} """
+    if name in os.environ and os.environ[name] != "":
+        return int(os.environ[name])
+    return default
+
+
+def schema_snapshot():
+    """ file name used to share the schema between processes, or None """
+    if "AUTO_SQL_SCHEMA_SNAPSHOT" in os.environ:
+        filename = os.environ["AUTO_SQL_SCHEMA_SNAPSHOT"]
+        return filename if filename != "" else None
+    if os.path.isdir("/ram"):
+        return "/ram/auto_sql_schema.json"
+    return None
+
+
+def metrics_directory():
+    """ directory used to share metrics between processes, or None """
+    if "AUTO_SQL_METRICS_DIR" in os.environ:
+        directory = os.environ["AUTO_SQL_METRICS_DIR"]
+        return directory if directory != "" else None
+    if os.path.isdir("/ram"):
+        return "/ram/auto_sql_metrics"
+    return None
+
+
+def collect_metrics():
+    """ copy the connection pool & cache numbers into the metrics """
+    pool_stats = pool.stats()
+    monitor.set("counter", "auto_sql_pool_reconnects_total",
+                pool_stats.pop("reconnects"))
+    monitor.set("counter", "auto_sql_pool_timeouts_total",
+                pool_stats.pop("timeouts"))
+    for key, value in pool_stats.items():
+        monitor.set("gauge", f"auto_sql_pool_{key}", value)
+
+    if flights is not None:
+        flight_stats = flights.stats()
+        monitor.set("counter", "auto_sql_coalesce_leaders_total",
+                    flight_stats.pop("leaders"))
+        for scope, value in flight_stats.items():
+            monitor.set("counter",
+                        "auto_sql_coalesced_total",
+                        value,
+                        scope=scope)
+
+    if replicas is not None:
+        replica_stats = replicas.stats()
+        monitor.set("counter", "auto_sql_replica_fallbacks_total",
+                    replica_stats["fallbacks"])
+        for name, state in replica_stats["replicas"].items():
+            monitor.set("counter",
+                        "auto_sql_replica_reads_total",
+                        state["reads"],
+                        replica=name)
+            monitor.set("gauge",
+                        "auto_sql_replica_usable",
+                        int(state["usable"]),
+                        replica=name)
+
+    for name, cache in [("results", results), ("joins", lookups),
+                        ("queries", templates)]:
+        for key, value in cache.stats().items():
+            if key == "tables":
+                for table, rows in value.items():
+                    monitor.set("gauge", "auto_sql_join_cache_rows", rows,
+                                table=table)
+            elif key in ("entries", "bytes"):
+                monitor.set("gauge", f"auto_sql_cache_{key}", value,
+                            cache=name)
+            else:
+                monitor.set("counter", f"auto_sql_cache_{key}_total", value,
+                            cache=name)
+
+
+def set_schema(new_schema):
+    """ start using {new_schema} & everything compiled from it """
     global schema
-    global cnx
-    cnx = connect_to_mysql()
-    if cnx is None:
-        print("ERROR: Failed to connect to MySQL")
+    global shapes
+    global typed_shapes
+    global schema_hash
+    schema_hash = hashlib.blake2b(json.dumps(new_schema,
+                                             sort_keys=True,
+                                             default=str).encode("utf8"),
+                                  digest_size=12).hexdigest()
+    shapes = row_shapes.compile_schema(new_schema)
+    typed_shapes = row_shapes.compile_schema(new_schema, typed=True)
+    schema = new_schema
+    if results is not None:
+        results.clear()
+    if templates is not None:
+        templates.clear()
+    if lookups is not None:
+        ttls = {}
+        if ":more:" in schema and "join-cache" in schema[":more:"]:
+            ttls = schema[":more:"]["join-cache"]
+        lookups.configure({t: ttls[t] for t in ttls if t in schema})
+
+
+def cache_ttl(table):
+    """ seconds results from {table} can be cached for, zero for no cache """
+    if ":more:" not in schema or "cache" not in schema[":more:"]:
+        return 0
+    return int(schema[":more:"]["cache"].get(table, 0))
+
+
+def result_cache_key(table, sent, etag):
+    """ key to cache the result of select {sent} on {table}, or None,
+        which includes its {etag}, so changes by other processes are seen """
+    if results is None or cache_ttl(table) <= 0 or "stream" in sent:
+        return None
+    if "where" in sent and isinstance(sent["where"], str):
+        return None
+    return ":".join(
+        [table, reply_mimetype(), etag,
+         json.dumps(sent, sort_keys=True)])
+
+
+def tables_used_by(table):
+    """ list of {table} & every table it can join to """
+    return [table] + [
+        this_col["join"]["table"]
+        for this_col in schema[table]["columns"].values()
+        if "join" in this_col
+    ]
+
+
+def table_changed(table):
+    """ {table} has been written to, so drop results that used it """
+    if "transaction" in flask.g:
+        flask.g.transaction.add(table)
+        return
+    versions.bump(table)
+    if results is not None:
+        results.invalidate(table)
+    if lookups is not None:
+        lookups.invalidate(table)
+
+
+def versions_directory():
+    """ directory used to share table versions between processes, or None """
+    if "AUTO_SQL_VERSIONS_DIR" in os.environ:
+        directory = os.environ["AUTO_SQL_VERSIONS_DIR"]
+        return directory if directory != "" else None
+    if os.path.isdir("/ram"):
+        return "/ram/auto_sql_versions"
+    return None
+
+
+def read_update_times(tables):
+    """ MySQL's `UPDATE_TIME` of each of {tables} """
+    names = [
+        db_cnx().string_literal(table.encode("utf8")).decode("utf8")
+        for table in tables
+    ]
+    run_query("select TABLE_NAME,UPDATE_TIME from information_schema.TABLES "
+              "where TABLE_SCHEMA=database() and TABLE_NAME in (" +
+              ",".join(names) + ")")
+    res = db_cnx().store_result()
+    return {
+        convert_string(row["TABLE_NAME"]): str(row["UPDATE_TIME"])
+        for row in res.fetch_row(maxrows=0, how=1)
+    }
+
+
+def make_etag(*data):
+    """ ETag for a response made from {data} """
+    return hashlib.blake2b(json.dumps([reply_mimetype(), *data],
+                                      sort_keys=True,
+                                      default=str).encode("utf8"),
+                           digest_size=12).hexdigest()
+
+
+def referenced_tables(table, sent):
+    """ {table}, the tables it joins to & others {sent} names columns of """
+    tables = tables_used_by(table)
+    cols = []
+    if isinstance(sent.get("where", None), dict):
+        for where_obj in sent["where"].values():
+            if isinstance(where_obj, dict):
+                cols.extend(where_obj)
+    cols.extend(clean_list_string(sent.get("group", [])))
+    if isinstance(sent.get("aggregate", None), dict):
+        for agg_cols in sent["aggregate"].values():
+            cols.extend(clean_list_string(agg_cols))
+
+    for col in cols:
+        if isinstance(col, str) and col.find(".") >= 0:
+            other = col.split(".")[0]
+            if other in schema and other not in tables:
+                tables.append(other)
+    return tables
+
+
+def table_etag(table, sent):
+    """ ETag for the result of {sent} on {table}, made from the versions
+        of the tables it uses, so it changes when any of them does """
+    tables = referenced_tables(table, sent)
+    data = [versions.version(tbl) for tbl in [":schema:"] + tables]
+    secs = env_int("AUTO_SQL_ETAG_MYSQL_SECS", 0)
+    if secs > 0:
+        data.append(versions.mysql_times(tables, secs, read_update_times))
+    return make_etag(flask.request.path, sent, data)
+
+
+def etags_on():
+    """ are `ETag` headers & `304` responses turned on """
+    return os.environ.get("AUTO_SQL_ETAGS", "off") == "on"
+
+
+def not_modified(etag):
+    """ a `304` response, if the client already has {etag}, or None """
+    if not etags_on() or etag not in flask.request.if_none_match:
+        return None
+    response = flask.Response(status=304)
+    response.vary.add("Accept")
+    return with_etag(response, etag)
+
+
+def with_etag(response, etag):
+    """ add {etag} to {response}, asking clients to check it before reuse """
+    if etag is None or not etags_on():
+        return response
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+
+def flights_directory():
+    """ directory used to coalesce requests across processes, or None """
+    if "AUTO_SQL_FLIGHTS_DIR" in os.environ:
+        directory = os.environ["AUTO_SQL_FLIGHTS_DIR"]
+        return directory if directory != "" else None
+    if os.path.isdir("/ram"):
+        return "/ram/auto_sql_flights"
+    return None
+
+
+def coalesce(key, func):
+    """ run {func}, sharing its result with identical requests for {key}
+        made at the same time, as `AUTO_SQL_COALESCE` allows """
+    if flights is None:
+        return func()
+    return flights.run(key, func)
+
+
+def new_pool(conn=None):
+    """ connection pool for the MySQL server at {conn}, or `MYSQL_CONNECT` """
+    return mysql_pool.ConnectionPool(
+        functools.partial(connect_to_mysql, conn),
+        size=env_int("AUTO_SQL_POOL_SIZE", 2),
+        idle_ping=env_int("AUTO_SQL_POOL_PING", 30),
+        max_lifetime=env_int("AUTO_SQL_POOL_LIFETIME", 3600),
+        max_backoff=env_int("AUTO_SQL_POOL_BACKOFF", 30),
+        wait=env_int("AUTO_SQL_POOL_WAIT", 10))
+
+
+def make_replicas():
+    """ the read replicas listed in `MYSQL_REPLICAS`, or None """
+    conns = [
+        conn.strip()
+        for conn in os.environ.get("MYSQL_REPLICAS", "").split(",")
+        if conn.strip() != ""
+    ]
+    if len(conns) <= 0:
+        return None
+    return mysql_replicas.ReplicaSet(
+        {conn: new_pool(conn)
+         for conn in conns},
+        max_lag=env_int("AUTO_SQL_REPLICA_MAX_LAG", 5),
+        check_every=env_int("AUTO_SQL_REPLICA_CHECK", 5))
+
+
+def read_schema():
+    """ load the schema & join cache, from a replica if one is usable """
+    read_pool = None if replicas is None else replicas.pick()
+    if read_pool is not None:
+        try:
+            with read_pool.connection() as cnx:
+                set_schema(mysql_schema.load_db_schema(cnx, schema_snapshot()))
+                preload_join_cache(cnx)
+            return
+        except MySQLdb.Error:
+            replicas.failed(read_pool)
+
+    with pool.connection() as cnx:
+        set_schema(mysql_schema.load_db_schema(cnx, schema_snapshot()))
+        preload_join_cache(cnx)
+
+
+def make_connection():
+    """ create the MySQL connection pool & load the schema """
+    global pool
+    global replicas
+    global results
+    global lookups
+    global templates
+    global versions
+    global flights
+    global join_workers
+    global monitor
+    log_queue.configure(
+        level=os.environ.get("AUTO_SQL_LOG_LEVEL", "info"),
+        sql_chars=env_int("AUTO_SQL_LOG_SQL_CHARS", 500),
+        sql_sample=env_int("AUTO_SQL_LOG_SQL_PERCENT", 100) / 100)
+    monitor = metrics.Metrics(metrics_directory(),
+                              env_int("AUTO_SQL_METRICS_SAVE", 5))
+    pool = new_pool()
+    replicas = make_replicas()
+    results = result_cache.ResultCache(
+        max_entries=env_int("AUTO_SQL_CACHE_ENTRIES", 1000),
+        max_bytes=env_int("AUTO_SQL_CACHE_BYTES", 16 * 1024 * 1024))
+    lookups = join_cache.JoinCache(
+        max_rows=env_int("AUTO_SQL_JOIN_CACHE_ROWS", 5000))
+    templates = query_shapes.QueryShapes(
+        max_entries=env_int("AUTO_SQL_QUERY_SHAPES", 500))
+    versions = table_versions.TableVersions(versions_directory())
+    coalescing = os.environ.get("AUTO_SQL_COALESCE", "process")
+    if coalescing in ("process", "host"):
+        flights = single_flight.SingleFlight(
+            flights_directory() if coalescing == "host" else None,
+            wait=env_int("AUTO_SQL_COALESCE_WAIT", 5))
+    if env_int("AUTO_SQL_JOIN_THREADS", 1) > 1:
+        join_workers = ThreadPoolExecutor(
+            max_workers=env_int("AUTO_SQL_JOIN_THREADS", 1))
+
+    try:
+        read_schema()
+    except MySQLdb.Error:
+        log_queue.error("Failed to connect to MySQL")
         sys.exit(1)
 
-    schema = mysql_schema.load_db_schema(cnx)
+    monitor.start(collect_metrics)
 
 
 def check_supplied_modifiers(sent, allowed):
@@ -477,6 +1223,47 @@ application = flask.Flask("MySQL-Rest/API")
 make_connection()
 
 
+@application.before_request
+def start_request_timer():
+    """ note when this request started """
+    flask.g.started = time.perf_counter()
+
+
+@application.after_request
+def count_request(response):
+    """ add this request to the metrics """
+    route = ""
+    if flask.request.url_rule is not None:
+        route = flask.request.url_rule.rule
+    table = (flask.request.view_args or {}).get("table", "")
+    if table not in schema:
+        table = ""
+
+    monitor.count("auto_sql_requests_total",
+                  route=route,
+                  method=flask.request.method,
+                  status=response.status_code,
+                  table=table)
+    monitor.observe("auto_sql_request_seconds",
+                    time.perf_counter() - flask.g.started,
+                    route=route)
+    if not response.is_streamed:
+        monitor.count("auto_sql_response_bytes_total",
+                      response.content_length or 0,
+                      table=table)
+    return response
+
+
+@application.teardown_appcontext
+def release_cnx(__):
+    """ return this request's MySQL connection to the pool """
+    if "slow" in flask.g:
+        log_slow_queries()
+    cnx = flask.g.pop("cnx", None)
+    if cnx is not None:
+        request_pool().release(cnx)
+
+
 @application.route("/v1", methods=['GET'])
 def hello():
     """ respond with a `hello` to confirm working """
@@ -487,15 +1274,41 @@ def hello():
 @application.route("/v1/meta/reload", methods=['GET'])
 def reload_schema():
     """ reload the schema """
-    global schema
-    schema = mysql_schema.load_db_schema(cnx)
+    set_schema(
+        mysql_schema.load_db_schema(db_cnx(), schema_snapshot(),
+                                    refresh=True))
+    versions.bump(":schema:")
+    preload_join_cache(db_cnx())
     return retmsg(200, schema)
 
 
+@application.route("/v1/meta/cache", methods=['GET'])
+def give_cache_stats():
+    """ respond with the result & join cache numbers """
+    return retmsg(
+        200, {
+            "results": results.stats(),
+            "joins": lookups.stats(),
+            "queries": templates.stats()
+        })
+
+
+@application.route("/v1/meta/metrics", methods=['GET'])
+def give_metrics():
+    """ all the workers' metrics, in Prometheus text format """
+    collect_metrics()
+    return flask.Response(metrics.prometheus_text(monitor.merged()),
+                          mimetype="text/plain; version=0.0.4")
+
+
 @application.route("/v1/meta/schema", methods=['GET'])
 def give_schema():
     """ respond with full schema """
-    return retmsg(200, schema)
+    etag = make_etag(schema_hash)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    return with_etag(retmsg(200, schema), etag)
 
 
 @application.route("/v1/meta/schema/<table>", methods=['GET'])
@@ -503,7 +1316,11 @@ def give_table_schema(table):
     """ respond with schema for one <table> """
     if table not in schema:
         json_abort(404, f"Table '{table}' does not exist")
-    return retmsg(200, schema[table])
+    etag = make_etag(schema_hash, table)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    return with_etag(retmsg(200, schema[table]), etag)
 
 
 def make_order_clause(sent, table):
@@ -528,17 +1345,93 @@ def make_order_clause(sent, table):
     return " order by " + ",".join(order_list)
 
 
-def build_sql(table, sent, start_sql):
-    """ build the SQL needed to run the users query on {table} """
-    sql = (start_sql + where_clause(table, sent) +
-           (make_order_clause(sent, table) if "order" in sent else ""))
+def after_columns(table, sent):
+    """ index columns used to page through {table} with `after` """
+    if "limit" not in sent:
+        json_abort(406, "`after` without `limit` is not allowed")
+    for modifier in ["skip", "order", "stream"]:
+        if modifier in sent:
+            json_abort(406, f"`after` can not be used with `{modifier}`")
+    if "where" in sent and isinstance(sent["where"], str):
+        json_abort(406, "`after` can not be used with a string `where`")
 
+    idx_cols = get_idx_cols(table, sent)
+    if ":rowid:" in idx_cols:
+        json_abort(406, f"`after` needs a unique index on table `{table}`")
+    this_idxs = schema[table]["indexes"]
+    for idx in this_idxs.values():
+        if idx.get("unique", False) and set(idx["columns"]) <= set(idx_cols):
+            return idx_cols
+
+    best_idx = find_best_index(this_idxs)
+    if best_idx is None:
+        json_abort(406, f"`after` needs a unique index on table `{table}`")
+    return idx_cols + [
+        col for col in this_idxs[best_idx]["columns"] if col not in idx_cols
+    ]
+
+
+def decode_after(token, idx_cols):
+    """ decode the `after` {token} into the last row id & key values """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token.encode("utf8")))
+    except (binascii.Error, ValueError, AttributeError):
+        data = None
+    if (not isinstance(data, dict) or not isinstance(data.get("keys"), list)
+            or not isinstance(data.get("rowid"), int)
+            or len(data["keys"]) != len(idx_cols)):
+        json_abort(400, "The `after` modifier is not valid")
+    return data["rowid"], data["keys"]
+
+
+def encode_after(idx_cols, row):
+    """ make the `after` token to continue from {row} """
+    keys = []
+    for col in idx_cols:
+        if row.get(col, None) is None:
+            json_abort(400, f"Can not use `after`, column `{col}` is NULL")
+        val = row[col]
+        keys.append(plain_value(val) if isinstance(val, dict) else val)
+    data = {"keys": keys, "rowid": row[":rowid:"]}
+    return base64.urlsafe_b64encode(
+        json.dumps(data, default=str).encode("utf8")).decode("utf8")
+
+
+def after_clauses(table, sent, idx_cols=None):
+    """ return row start, `where` & `order` to seek to the `after` row,
+        paging by the {idx_cols}, if given, otherwise by a unique index """
+    if idx_cols is None:
+        idx_cols = after_columns(table, sent)
+    this_cols = schema[table]["columns"]
+    tbl_cols = ",".join([table + "." + col for col in idx_cols])
+    order = " order by " + tbl_cols
+    if sent["after"] in (None, True, ""):
+        return 0, "", order
+
+    start, keys = decode_after(sent["after"], idx_cols)
+    vals = [add_data(val, this_cols[col]) for col, val in zip(idx_cols, keys)]
+    return start, "(" + tbl_cols + ")>(" + ",".join(vals) + ")", order
+
+
+def build_sql(table, sent, start_sql, idx_cols=None):
+    """ build the SQL needed to run the users query on {table} """
+    check_indexed(table, sent)
+    where = where_clause(table, sent)
     start = 0
+    if "after" in sent:
+        start, after, order = after_clauses(table, sent, idx_cols)
+        if len(after) > 0:
+            where = where + (" and " if len(where) > 0 else " where ") + after
+        sql = start_sql + where + order
+    else:
+        sql = (start_sql + where +
+               (make_order_clause(sent, table) if "order" in sent else ""))
+
     if "limit" in sent:
-        sql = sql + " limit " + str(int(sent["limit"]))
+        sql = sql + " limit " + add_data(sent["limit"], PLAIN_INT)
         if "skip" in sent:
             start = int(sent["skip"])
-            sql = sql + " offset " + str(start)
+            sql = sql + " offset " + add_data(start, PLAIN_INT)
     else:
         if "skip" in sent:
             json_abort(406, "`skip` without `limit` is not allowed")
@@ -546,11 +1439,100 @@ def build_sql(table, sent, start_sql):
     return start, sql
 
 
+def value_count(ask_item, data):
+    """ how many values a `where` comparison {ask_item} of {data} has """
+    if ask_item == "=" and isinstance(data, list):
+        return ["in", len(data)]
+    return len(clean_list_string(data))
+
+
+def query_shape(table, sent):
+    """ key for the shape of select {sent} on {table}, with each `where`
+        value replaced by a count, or None if it can not be compiled """
+    where = []
+    if "where" in sent:
+        if not isinstance(sent["where"], dict):
+            return None
+        for ask_item, where_obj in sent["where"].items():
+            if not isinstance(where_obj, dict):
+                return None
+            where.append([
+                ask_item,
+                [[col, value_count(ask_item, data)]
+                 for col, data in where_obj.items()]
+            ])
+
+    after = None
+    if "after" in sent:
+        after = "start" if sent["after"] in (None, True, "") else "token"
+
+    return json.dumps([table, where, after] +
+                      [sent.get(item, None) for item in QUERY_SHAPE_ITEMS] +
+                      ["limit" in sent, "skip" in sent])
+
+
+def where_values(sent):
+    """ the `where` values in {sent}, in the order `where_clause` uses them """
+    values = []
+    for ask_item, where_obj in sent.get("where", {}).items():
+        for data in where_obj.values():
+            if ask_item == "=" and isinstance(data, list):
+                values.extend(data)
+            else:
+                values.extend(clean_list_string(data))
+    return values
+
+
+def compile_select(table, sent):
+    """ build the select SQL for {sent} on {table} as a template """
+    flask.g.slots = []
+    try:
+        sql = build_sql(
+            table, sent,
+            f"select {select_columns(table, sent)} from {table} ")[1]
+    finally:
+        slots = flask.g.pop("slots")
+
+    template = query_shapes.make_template(sql, slots)
+    if template is not None and "after" in sent:
+        template["after"] = after_columns(table, sent)
+    return template
+
+
+def select_sql(table, sent):
+    """ start row & select SQL for {sent} on {table}, filled in from
+        the compiled template for the shape of {sent} """
+    key = query_shape(table, sent)
+    template = None if key is None else templates.get(key)
+    if template is None and key is not None:
+        template = compile_select(table, sent)
+        if template is not None:
+            templates.put(key, template)
+
+    if template is None:
+        return build_sql(
+            table, sent, f"select {select_columns(table, sent)} from {table} ")
+
+    start = 0
+    values = where_values(sent)
+    if "after" in sent and sent["after"] not in (None, True, ""):
+        start, keys = decode_after(sent["after"], template["after"])
+        values.extend(keys)
+    if "limit" in sent:
+        values.append(sent["limit"])
+    if "skip" in sent:
+        start = int(sent["skip"])
+        values.append(start)
+
+    return start, query_shapes.fill_template(template, values, add_data)
+
+
 def get_sql_rows(sql, start):
     """ run the {sql} and return the rows """
     run_query(sql)
-    res = cnx.store_result()
-    rows = [r for r in res.fetch_row(maxrows=0, how=1)]
+    with timed("fetch"):
+        res = db_cnx().store_result()
+        rows = [r for r in res.fetch_row(maxrows=0, how=1)]
     if len(rows) <= 0:
         return {}, 200
 
@@ -562,6 +1544,155 @@ def get_sql_rows(sql, start):
     return rows
 
 
+def stream_sql_rows(stream, table, start, sent, framing):
+    """ generate {framing} text of the rows in {stream}, a batch at a time """
+    batch = env_int("AUTO_SQL_STREAM_BATCH", 1000)
+    rowid = start + 1
+    sep = b""
+    join = which_joins(sent)
+    if framing == "json":
+        yield b"{" + serialise.json_dumps(table) + b": ["
+    while True:
+        try:
+            rows = [
+                r for r in stream["res"].fetch_row(maxrows=batch, how=1)
+            ]
+        except MySQLdb.Error as exc:
+            error = {"code": exc.args[0], "message": exc.args[1]}
+            if framing == "json":
+                yield b"], " + serialise.json_dumps({":error:": error})[1:]
+            else:
+                yield serialise.json_dumps({":error:": error}) + b"\n"
+            return
+
+        if len(rows) <= 0:
+            break
+
+        for row in rows:
+            row[":rowid:"] = rowid
+            rowid = rowid + 1
+        monitor.count("auto_sql_rows_total", len(rows), table=table)
+        prepare_row_data(rows, table)
+        if join is not None:
+            with timed("join"):
+                handle_joins({table: rows}, join, False,
+                             join_projections(sent))
+
+        with timed("serialise"):
+            if framing == "json":
+                data = sep + b",".join([serialise.json_dumps(r) for r in rows])
+                sep = b","
+            else:
+                data = b"".join(
+                    [serialise.json_dumps(r) + b"\n" for r in rows])
+        monitor.count("auto_sql_response_bytes_total", len(data), table=table)
+        yield data
+
+    stream["finished"] = True
+    if framing == "json":
+        yield b"]}"
+
+
+def end_stream(stream):
+    """ return the {stream} connection, drop it if rows were left unread """
+    if stream["finished"]:
+        stream["pool"].release(stream["cnx"])
+    else:
+        stream["pool"].discard(stream["cnx"])
+
+
+def stream_response(table, sent, sql, start):
+    """ run the {sql} unbuffered & stream the rows back in batches """
+    framing = sent["stream"]
+    if isinstance(framing, bool):
+        framing = "json" if framing else None
+    if framing not in ("json", "ndjson", None):
+        json_abort(400, "The `stream` modifier must be `json` or `ndjson`")
+    if framing is None:
+        return None
+
+    if "by" in sent or "join-basic" in sent:
+        json_abort(406, "`by` & `join-basic` can not be used with `stream`")
+
+    flask.g.mimetype = "application/json"
+    run_query(sql)
+    stream = {
+        "cnx": flask.g.pop("cnx"),
+        "pool": request_pool(),
+        "finished": False
+    }
+    try:
+        stream["res"] = stream["cnx"].use_result()
+    except MySQLdb.Error as exc:
+        stream["pool"].discard(stream["cnx"])
+        mysql_abort(exc, "B")
+
+    if which_joins(sent) is not None:
+        # joins need a connection of their own while the stream is read,
+        # take it now, so running out fails before any rows are sent
+        try:
+            db_cnx()
+        except BaseException:
+            stream["pool"].discard(stream["cnx"])
+            raise
+
+    response = flask.Response(
+        flask.stream_with_context(
+            stream_sql_rows(stream, table, start, sent, framing)),
+        mimetype=("application/json"
+                  if framing == "json" else "application/x-ndjson"))
+    response.call_on_close(lambda: end_stream(stream))
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def which_joins(sent):
+    """ list of join columns asked for in {sent}, or None """
+    if "join" not in sent:
+        return None
+    join = sent["join"]
+    if isinstance(join, bool):
+        join = [":all:"] if join else None
+    if join is None:
+        return None
+    if isinstance(join, dict):
+        return [col for col in join if join[col] is not False]
+    return clean_list_string(join)
+
+
+def join_projections(sent):
+    """ columns asked for from each joined table, keyed by join column """
+    if "join" not in sent or not isinstance(sent["join"], dict):
+        return {}
+    return {
+        col: clean_list_string(cols)
+        for col, cols in sent["join"].items() if not isinstance(cols, bool)
+    }
+
+
+def select_columns(table, sent):
+    """ the select list for {table}, allowing for a `columns` modifier """
+    if "columns" not in sent:
+        return table + ".*"
+
+    this_cols = schema[table]["columns"]
+    cols = [col for col in clean_list_string(sent["columns"]) if col != ""]
+    for col in cols:
+        if col not in this_cols:
+            json_abort(400, f"Column `{col}` is not in table `{table}`")
+    if len(cols) <= 0:
+        json_abort(400, "The `columns` modifier must list some columns")
+
+    if "by" in sent or "after" in sent:
+        idx_cols = (after_columns(table, sent)
+                    if "after" in sent else get_idx_cols(table, sent))
+        for col in idx_cols:
+            if col != ":rowid:" and col not in cols:
+                cols.append(col)
+
+    return ",".join([table + "." + col for col in cols])
+
+
 def process_one_set(set_clause, table):
     """ turn {set_clause} object into a sql insert statement """
     ret = []
@@ -597,51 +1728,63 @@ def get_idx_cols(table, sent):
     return idx_cols
 
 
-@application.route("/v1/data/<table>", methods=['PUT'])
-def insert_table_row(table):
-    """ do an sql insert on {table} """
+def insert_rows(table, sent):
+    """ do an sql insert of {sent} on {table} """
     if table not in schema:
         json_abort(404, f"Table '{table}' does not exist")
 
-    if (flask.request.json is None) or ("set" not in flask.request.json):
+    if (sent is None) or ("set" not in sent):
         json_abort(400, "A `set` clause is mandatory for an INSERT")
 
-    sent = flask.request.json
-    check_supplied_modifiers(sent, ["set"])
+    check_supplied_modifiers(sent, ["set", "on-duplicate"])
 
     if not isinstance(sent["set"], (dict, list)):
         json_abort(
             400,
             "In an INSERT, the `set` clause must be an object or list type")
 
-    if isinstance(sent["set"], dict):
+    if sent.get("on-duplicate", "update") not in ("update", "ignore"):
+        json_abort(400, "The `on-duplicate` must be `update` or `ignore`")
+
+    if isinstance(sent["set"], dict) and "on-duplicate" not in sent:
         set_list = process_one_set(sent["set"], table)
-        sql = f"insert into {table} set " + ",".join(set_list)
+        sqls = [f"insert into {table} set " + ",".join(set_list)]
+    elif isinstance(sent["set"], dict):
+        sqls = make_insert_from_list([sent["set"]], table, sent)
     else:
-        sql = make_insert_from_list(sent["set"], table)
-
-    run_query(sql)
-    cnx.store_result()
-
-    ret = {"affected_rows": cnx.affected_rows()}
-    if ret["affected_rows"] == 1:
+        sqls = make_insert_from_list(sent["set"], table, sent)
+
+    ret = {"affected_rows": 0}
+    with transaction() if len(sqls) > 1 else contextlib.nullcontext():
+        for sql in sqls:
+            run_query(sql)
+            cnx = db_cnx()
+            cnx.store_result()
+            ret["affected_rows"] += cnx.affected_rows()
+    table_changed(table)
+
+    if ret["affected_rows"] == 1 and len(sqls) == 1:
         row_id = cnx.insert_id()
         if row_id > 0:
             ret["row_id"] = row_id
 
-    return retmsg(200, ret)
+    return ret
 
 
-@application.route("/v1/data/<table>", methods=['PATCH'])
-def update_table_row(table):
-    """ do an sql update on {table} """
+@application.route("/v1/data/<table>", methods=['PUT'])
+def insert_table_row(table):
+    """ do an sql insert on {table} """
+    return retmsg(200, insert_rows(table, flask.request.json))
+
+
+def update_rows(table, sent):
+    """ do an sql update of {sent} on {table} """
     if table not in schema:
         return json_abort(404, f"Table '{table}' does not exist")
 
-    if (flask.request.json is None) or ("set" not in flask.request.json):
+    if (sent is None) or ("set" not in sent):
         return json_abort(400, "A `set` clause is mandatory for an UPDATE")
 
-    sent = flask.request.json
     check_supplied_modifiers(sent, ["where", "limit", "set"])
 
     if not isinstance(sent["set"], dict):
@@ -653,49 +1796,63 @@ def update_table_row(table):
     sql = build_sql(table, sent, sql)[1]
 
     run_query(sql)
+    cnx = db_cnx()
     cnx.store_result()
-    ret = cnx.affected_rows()
+    table_changed(table)
 
-    return retmsg(200, {"affected_rows": ret})
+    return {"affected_rows": cnx.affected_rows()}
 
 
-@application.route("/v1/data/<table>", methods=['DELETE'])
-def delete_table_row(table):
-    """ do an sql delete on {table} """
+@application.route("/v1/data/<table>", methods=['PATCH'])
+def update_table_row(table):
+    """ do an sql update on {table} """
+    return retmsg(200, update_rows(table, flask.request.json))
+
+
+def delete_rows(table, sent):
+    """ do an sql delete of {sent} on {table} """
     if table not in schema:
         json_abort(404, f"Table '{table}' does not exist")
 
-    if (flask.request.json is None) or ("where" not in flask.request.json):
+    if (sent is None) or ("where" not in sent):
         json_abort(400, "A `where` clause is mandatory for a DELETE")
 
-    check_supplied_modifiers(flask.request.json, ["where", "limit"])
+    check_supplied_modifiers(sent, ["where", "limit"])
 
-    sql = build_sql(table, flask.request.json, f"delete from {table} ")[1]
-    print(">>>A>>>", sql)
+    sql = build_sql(table, sent, f"delete from {table} ")[1]
 
     run_query(sql)
+    cnx = db_cnx()
     cnx.store_result()
-    ret = cnx.affected_rows()
+    table_changed(table)
 
-    return retmsg(200, {"affected_rows": ret})
+    return {"affected_rows": cnx.affected_rows()}
 
 
-@application.route("/v1/data/<table>", methods=['GET', 'POST'])
-def get_table_row(table):
-    """ run select queries """
-    if table not in schema:
-        json_abort(404, f"Table '{table}' does not exist")
+@application.route("/v1/data/<table>", methods=['DELETE'])
+def delete_table_row(table):
+    """ do an sql delete on {table} """
+    return retmsg(200, delete_rows(table, flask.request.json))
 
-    sent = flask.request.json if flask.request.json is not None else {}
-    check_supplied_modifiers(
-        sent, ["where", "limit", "skip", "by", "order", "join", "join-basic"])
 
-    start, sql = build_sql(table, sent, f"select {table}.* from {table} ")
-    sql_rows = get_sql_rows(sql, start)
+def is_columnar(sent):
+    """ has the user asked for the `columnar` format """
+    if "format" not in sent:
+        return False
+    if sent["format"] not in ("objects", "columnar"):
+        json_abort(400, "The `format` must be `objects` or `columnar`")
+    if sent["format"] != "columnar":
+        return False
 
-    if not isinstance(sql_rows, list):
-        return sql_rows
+    for modifier in ["by", "stream", "join-basic"]:
+        if modifier in sent:
+            json_abort(406, f"`{modifier}` can not be used with `columnar`")
+    return True
 
+
+def objects_result(table, sent, sql_rows):
+    """ format {sql_rows} from {table} as a list, or keyed set, of objects """
+    monitor.count("auto_sql_rows_total", len(sql_rows), table=table)
     prepare_row_data(sql_rows, table)
 
     if "by" in sent:
@@ -708,17 +1865,392 @@ def get_table_row(table):
     else:
         ret_rows = {table: sql_rows}
 
-    if "join" in sent:
-        join = sent["join"]
-        if isinstance(join, bool):
-            join = [":all:"] if join else None
-        if join is not None:
-            handle_joins(ret_rows, clean_list_string(join),
-                         ("join-basic" in sent and sent["join-basic"]))
+    after = None
+    if "after" in sent and len(sql_rows) >= int(sent["limit"]):
+        after = encode_after(after_columns(table, sent), sql_rows[-1])
+
+    join = which_joins(sent)
+    if join is not None:
+        with timed("join"):
+            handle_joins(ret_rows, join,
+                         ("join-basic" in sent and sent["join-basic"]),
+                         join_projections(sent))
+
+    if after is not None:
+        ret_rows[":after:"] = after
+
+    return ret_rows
+
+
+def columnar_result(table, sent, sql_rows):
+    """ format {sql_rows} from {table} as column names & lists of values """
+    monitor.count("auto_sql_rows_total", len(sql_rows), table=table)
+    this_shape = table_shape(table)
+    with timed("shape"):
+        columns, values = row_shapes.shape_columns(sql_rows, this_shape)
+    ret_rows = {table: {"columns": columns, "rows": values}}
+
+    enums = {
+        col: this_shape[col][1]
+        for col in columns
+        if col in this_shape and this_shape[col][1] is not None
+    }
+    if len(enums) > 0:
+        ret_rows[":enums:"] = enums
+
+    join = which_joins(sent)
+    if join is not None:
+        with timed("join"):
+            ret_rows.update(
+                columnar_joins(table, columns, values, join,
+                               join_projections(sent)))
+
+    if "after" in sent and len(values) >= int(sent["limit"]):
+        ret_rows[":after:"] = encode_after(after_columns(table, sent),
+                                           dict(zip(columns, values[-1])))
+
+    return ret_rows
+
+
+def columnar_joins(table, columns, values, which, projections):
+    """ load the rows joined to from columnar {values} of {table} """
+    need = {}
+    for pos, col in enumerate(columns):
+        target = join_this_column(table, col, which)
+        if target is None:
+            continue
+        for row in values:
+            if include_for_join(row[pos]):
+                if target not in need:
+                    need[target] = {}
+                need[target][row[pos]] = True
+
+    if len(need) <= 0:
+        return {}
+    return load_all_joins(need, joined_columns({table: []}, which,
+                                               projections))
+
+
+@application.route("/v1/data/<table>", methods=['GET', 'POST'])
+def get_table_row(table):
+    """ run select queries """
+    if table not in schema:
+        json_abort(404, f"Table '{table}' does not exist")
+
+    sent = flask.request.json if flask.request.json is not None else {}
+    check_supplied_modifiers(sent, SELECT_MODIFIERS)
+    columnar = is_columnar(sent)
+    use_replica(referenced_tables(table, sent))
+
+    etag = None
+    if not sent.get("stream", False):
+        etag = table_etag(table, sent)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+
+    cache_key = result_cache_key(table, sent, etag)
+    if cache_key is not None:
+        cached = results.get(cache_key)
+        if cached is not None:
+            return with_etag(make_response(200, cached, reply_mimetype()),
+                             etag)
+
+    if "stream" in sent:
+        with timed("build"):
+            start, sql = select_sql(table, sent)
+        response = stream_response(table, sent, sql, start)
+        if response is not None:
+            return response
+
+    body = coalesce(
+        ":".join([
+            table,
+            reply_mimetype(), etag or "",
+            json.dumps(sent, sort_keys=True)
+        ]), lambda: select_body(table, sent, columnar))
+    if cache_key is not None:
+        results.put(cache_key, body, tables_used_by(table), cache_ttl(table))
+    return with_etag(make_response(200, body, reply_mimetype()), etag)
+
+
+def select_body(table, sent, columnar):
+    """ run select {sent} on {table} & return the serialised result """
+    with timed("build"):
+        start, sql = select_sql(table, sent)
+    sql_rows = get_sql_rows(sql, start)
+
+    if not isinstance(sql_rows, list):
+        return reply_body({})
+
+    if columnar:
+        return reply_body(columnar_result(table, sent, sql_rows))
+    return reply_body(objects_result(table, sent, sql_rows))
+
+
+def select_rows(table, sent):
+    """ run select {sent} on {table}, without the result cache """
+    if table not in schema:
+        json_abort(404, f"Table '{table}' does not exist")
+
+    sent = sent if sent is not None else {}
+    check_supplied_modifiers(sent, SELECT_MODIFIERS)
+    if "stream" in sent:
+        json_abort(406, "`stream` can not be used in a batch")
+    columnar = is_columnar(sent)
+
+    with timed("build"):
+        start, sql = select_sql(table, sent)
+    sql_rows = get_sql_rows(sql, start)
+    if not isinstance(sql_rows, list):
+        return {}
+
+    if columnar:
+        return columnar_result(table, sent, sql_rows)
+    return objects_result(table, sent, sql_rows)
+
+
+BATCH_OPERATIONS = {
+    "select": select_rows,
+    "insert": insert_rows,
+    "update": update_rows,
+    "delete": delete_rows
+}
+
+
+def batch_row_ids(data, row_ids):
+    """ replace each `{":row_id:": N}` in {data} with the `row_id`
+        of operation N, from {row_ids} """
+    if isinstance(data, dict):
+        if len(data) == 1 and ":row_id:" in data:
+            pos = data[":row_id:"]
+            if not isinstance(pos, int) or pos not in row_ids:
+                json_abort(400, f"Operation `{pos}` has no `row_id`")
+            return row_ids[pos]
+        return {key: batch_row_ids(val, row_ids) for key, val in data.items()}
+    if isinstance(data, list):
+        return [batch_row_ids(item, row_ids) for item in data]
+    return data
+
+
+def check_batch(sent):
+    """ check the list of operations in batch {sent} """
+    if not isinstance(sent, dict) or not isinstance(
+            sent.get("operations", None), list):
+        json_abort(400, "An `operations` list is mandatory for a batch")
+    check_supplied_modifiers(sent, ["operations"])
+
+    for pos, this_op in enumerate(sent["operations"]):
+        if not isinstance(this_op, dict):
+            json_abort(400, f"Operation `{pos}` must be an object")
+        check_supplied_modifiers(this_op, ["op", "table", "body"])
+        if (not isinstance(this_op.get("op", None), str)
+                or this_op["op"] not in BATCH_OPERATIONS):
+            json_abort(400, f"Operation `{pos}` has a bad or missing `op`")
+        if (not isinstance(this_op.get("table", None), str)
+                or this_op["table"] not in schema):
+            json_abort(404, f"Operation `{pos}` has a bad or missing `table`")
+        if "body" in this_op and not isinstance(this_op["body"], dict):
+            json_abort(400, f"Operation `{pos}` body must be an object")
+
+
+@application.route("/v1/batch", methods=['POST'])
+def run_batch():
+    """ run a list of operations in one transaction """
+    sent = flask.request.json
+    check_batch(sent)
+
+    row_ids = {}
+    ret = []
+    with transaction():
+        for pos, this_op in enumerate(sent["operations"]):
+            body = batch_row_ids(this_op.get("body", None), row_ids)
+            if body is not None and not isinstance(body, dict):
+                json_abort(400, f"Operation `{pos}` body must be an object")
+            this_ret = BATCH_OPERATIONS[this_op["op"]](this_op["table"], body)
+            if this_op["op"] == "insert" and "row_id" in this_ret:
+                row_ids[pos] = this_ret["row_id"]
+            ret.append(this_ret)
+
+    return retmsg(200, {"operations": ret})
+
+
+def aggregate_column(sql_joins, table, col):
+    """ SQL name, table & column for {col}, which may be in a joined table """
+    if col.find(".") >= 0:
+        sql_col, dst_table = find_foreign_column(sql_joins, table, col)
+        dst_col = col.split(".")[1]
+    else:
+        sql_col, dst_table, dst_col = table + "." + col, table, col
+
+    if dst_col not in schema[dst_table]["columns"]:
+        json_abort(400, f"Column `{dst_col}` is not in table `{dst_table}`")
+    return sql_col, dst_table, dst_col
+
+
+def aggregate_shape(func, dst_table, dst_col):
+    """ converter & enums to format {func} of {dst_table}.{dst_col} """
+    if func == "count":
+        return (int, None)
+    typed = serialise.FORMATS[reply_mimetype()]["typed"]
+    this_shape = (typed_shapes if typed else shapes)[dst_table][dst_col]
+    if func in ("min", "max"):
+        return this_shape
+    if func == "sum" and schema[dst_table]["columns"][dst_col]["is_plain_int"]:
+        return (int, None)
+    return (None if typed else float, None)
+
+
+def aggregate_sql(table, sent, shape):
+    """ build the `group by` SQL for {sent}, put output formats in {shape} """
+    typed = serialise.FORMATS[reply_mimetype()]["typed"]
+    sql_joins = {}
+    select = []
+    groups = []
+    for col in clean_list_string(sent.get("group", [])):
+        sql_col, dst_table, dst_col = aggregate_column(sql_joins, table, col)
+        select.append(f"{sql_col} as `{col}`")
+        groups.append(sql_col)
+        shape[col] = (typed_shapes if typed else shapes)[dst_table][dst_col]
+
+    aggs = sent.get("aggregate", {"count": "*"})
+    if not isinstance(aggs, dict) or len(aggs) <= 0:
+        json_abort(400, "The `aggregate` modifier must be an object")
+    for func in aggs:
+        if func not in AGGREGATES:
+            json_abort(400, f"Aggregate `{func}` not supported")
+        for col in clean_list_string(aggs[func]):
+            name = f"{func}({col})"
+            if col == "*" and func == "count":
+                sql_col, dst_table, dst_col = "*", None, None
+            else:
+                sql_col, dst_table, dst_col = aggregate_column(
+                    sql_joins, table, col)
+            select.append(f"{func}({sql_col}) as `{name}`")
+            shape[name] = aggregate_shape(func, dst_table, dst_col)
+
+    where = ""
+    if "where" in sent:
+        if isinstance(sent["where"], str):
+            json_abort(406, "A string `where` can not be used to aggregate")
+        check_indexed(table, {"where": sent["where"]})
+        where = where_conditions(sql_joins, table, sent)
+
+    sql = (f"select {','.join(select)} from {table} " +
+           " ".join([sql_joins[x] for x in sql_joins]) +
+           (" where " + where if len(where) > 0 else "") +
+           (" group by " + ",".join(groups) if len(groups) > 0 else ""))
+
+    if "order" in sent:
+        order_list = []
+        for order in clean_list_string(sent["order"]):
+            tst = order.split(" ")
+            if tst[0] not in shape:
+                json_abort(400, f"Can not order by '{tst[0]}'")
+            if len(tst) > 1 and tst[1] not in ("asc", "desc"):
+                json_abort(
+                    400,
+                    f"Only 'asc'/'desc' are allowed as 'order' modifiers, not '{tst[1]}'"
+                )
+            order_list.append(f"`{tst[0]}` " +
+                              (tst[1] if len(tst) > 1 else ""))
+        sql = sql + " order by " + ",".join(order_list)
+
+    if "limit" in sent:
+        sql = sql + " limit " + str(int(sent["limit"]))
+
+    return sql
+
+
+@application.route("/v1/aggregate/<table>", methods=['GET', 'POST'])
+def aggregate_table_rows(table):
+    """ run `group by` queries with count/sum/min/max/avg """
+    if table not in schema:
+        json_abort(404, f"Table '{table}' does not exist")
+
+    sent = flask.request.json if flask.request.json is not None else {}
+    check_supplied_modifiers(
+        sent, ["where", "group", "aggregate", "order", "limit"])
+    use_replica(referenced_tables(table, sent))
+
+    etag = table_etag(table, sent)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    shape = {}
+    with timed("build"):
+        sql = aggregate_sql(table, sent, shape)
+    run_query(sql)
+    with timed("fetch"):
+        res = db_cnx().store_result()
+        rows = [r for r in res.fetch_row(maxrows=0, how=1)]
+    monitor.count("auto_sql_rows_total", len(rows), table=table)
+    with timed("shape"):
+        row_shapes.shape_rows(rows, shape)
+
+    return with_etag(retmsg(200, {table: rows}), etag)
+
+
+def change_columns(table):
+    """ columns to page through the changes to {table} in order by """
+    if (":more:" not in schema or "changes" not in schema[":more:"]
+            or table not in schema[":more:"]["changes"]):
+        json_abort(404, f"Changes to table '{table}' are not available")
+
+    col = schema[":more:"]["changes"][table]
+    if col not in schema[table]["columns"]:
+        json_abort(404, f"Column `{col}` is not in table `{table}`")
+
+    idx_cols = [col]
+    this_idxs = schema[table]["indexes"]
+    best_idx = find_best_index(this_idxs)
+    if best_idx is not None:
+        idx_cols.extend(
+            [idx for idx in this_idxs[best_idx]["columns"] if idx != col])
+    return idx_cols
+
+
+@application.route("/v1/changes/<table>", methods=['GET', 'POST'])
+def get_table_changes(table):
+    """ rows of {table} changed since the `since` cursor """
+    if table not in schema:
+        json_abort(404, f"Table '{table}' does not exist")
+
+    sent = flask.request.json if flask.request.json is not None else {}
+    check_supplied_modifiers(sent, ["since", "limit", "where", "by"])
+    if "where" in sent and isinstance(sent["where"], str):
+        json_abort(406, "A string `where` can not be used with changes")
+    idx_cols = change_columns(table)
+
+    query = {
+        "limit": sent.get("limit", env_int("AUTO_SQL_CHANGES_LIMIT", 1000)),
+        "after": sent.get("since", None)
+    }
+    if "where" in sent:
+        query["where"] = sent["where"]
+    with timed("build"):
+        start, sql = build_sql(table, query, f"select {table}.* from {table} ",
+                               idx_cols)
+
+    sql_rows = get_sql_rows(sql, start)
+    if not isinstance(sql_rows, list):
+        sql_rows = []
+
+    since = query["after"]
+    if len(sql_rows) > 0:
+        since = encode_after(idx_cols, sql_rows[-1])
+    complete = len(sql_rows) < int(query["limit"])
 
+    keyed = {"by": sent["by"]} if "by" in sent else {}
+    ret_rows = objects_result(table, keyed, sql_rows)
+    ret_rows[":since:"] = since
+    ret_rows[":complete:"] = complete
     return retmsg(200, ret_rows)
 
 
 if __name__ == "__main__":
     application.run()
-    cnx.close()
+    pool.close_all()
+    if replicas is not None:
+        replicas.close_all()
@@ -0,0 +1,43 @@
+#! /usr/bin/python3
+""" micro-benchmark of the old `unhex()` value encoder against driver escaping """
+
+import sys
+import timeit
+from MySQLdb import _mysql
+
+TEST_VALUES = [
+    "AAPL", "john.smith@example.com", "O'Reilly & Sons, \"Ltd\"",
+    "a much longer free text value with a few words in it, " * 4,
+    "£ 100 – ünïcödé"
+]
+
+
+def hex_literal(data):
+    """ the old per-character `unhex()` encoder, as it was in `add_data` """
+    return "unhex('" + "".join([hex(ord(a))[2:] for a in data]) + "')"
+
+
+def driver_literal(data):
+    """ the new encoder, as `add_data` does it, but without a connection """
+    return _mysql.string_literal(data.encode("utf8")).decode("utf8")
+
+
+def run_bench(name, func, loops):
+    """ time {func} over all the test values {loops} times """
+    secs = timeit.timeit(lambda: [func(v) for v in TEST_VALUES], number=loops)
+    per_val = secs * 1e9 / (loops * len(TEST_VALUES))
+    size = sum(len(func(v)) for v in TEST_VALUES)
+    print(f"{name:>8}: {per_val:8.1f} ns/value, {size} bytes of SQL")
+    return per_val
+
+
+def main():
+    """ run the benchmark """
+    loops = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    old = run_bench("unhex", hex_literal, loops)
+    new = run_bench("driver", driver_literal, loops)
+    print(f"speed-up: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
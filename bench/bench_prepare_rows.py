@@ -0,0 +1,115 @@
+#! /usr/bin/python3
+""" benchmark of row formatting, old per-cell lookups against compiled shapes """
+
+import copy
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import row_shapes  # pylint: disable=wrong-import-position
+
+schema = {}
+
+
+def old_prepare_row_data(rows, table):
+    """ `prepare_row_data`, as it was before compiled shapes """
+    for row in rows:
+        for col in [r for r in row]:
+            if row[col] is None:
+                del row[col]
+            else:
+                row[col] = old_clean_col_data(row[col], table, col)
+                if ("enums" in schema[":more:"]
+                        and col in schema[":more:"]["enums"]
+                        and row[col] in schema[":more:"]["enums"][col]):
+                    row[col] = {
+                        ":value:": row[col],
+                        ":text:": schema[":more:"]["enums"][col][row[col]]
+                    }
+
+
+def old_clean_col_data(data, table, column):
+    """ `clean_col_data`, as it was before compiled shapes """
+    if data is None or column[0] == ":":
+        return data
+
+    ret = data
+    this_col = schema[table]["columns"][column]
+
+    if this_col["type"] == "boolean":
+        ret = int(data) != 0
+    elif this_col["type"] == "decimal":
+        ret = float(data)
+    elif this_col["is_plain_int"]:
+        ret = int(data)
+    elif isinstance(data, datetime):
+        ret = data.strftime('%Y-%m-%d %H:%M:%S')
+    elif not isinstance(data, str):
+        ret = str(data)
+
+    return ret
+
+
+def sample_value(this_col, num):
+    """ make up a value for {this_col}, like MySQL would give us """
+    if num % 7 == 0 and this_col["null"]:
+        return None
+    if this_col["type"] == "boolean":
+        return num % 2
+    if this_col["type"] == "decimal":
+        return Decimal(num) / 100
+    if this_col["is_plain_int"]:
+        return num
+    if this_col["type"] in ("datetime", "date"):
+        return datetime(2021, 1, 1 + num % 28, num % 24, num % 60)
+    return "value-" + str(num)
+
+
+def make_rows(table, count):
+    """ make {count} rows for {table} """
+    cols = schema[table]["columns"]
+    rows = []
+    for num in range(count):
+        row = {col: sample_value(cols[col], num) for col in cols}
+        row[":rowid:"] = num + 1
+        rows.append(row)
+    return rows
+
+
+def run_bench(name, func, rows):
+    """ time {func} formatting a copy of {rows} """
+    rows = copy.deepcopy(rows)
+    start = time.perf_counter()
+    func(rows)
+    secs = time.perf_counter() - start
+    print(f"{name:>9}: {len(rows) / secs:12,.0f} rows/sec")
+    return rows, secs
+
+
+def main():
+    """ run the benchmark """
+    global schema
+    table = sys.argv[1] if len(sys.argv) > 1 else "domains"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    with open(os.path.join(os.path.dirname(__file__), "..",
+                           "schema.json")) as file:
+        schema = json.load(file)
+
+    rows = make_rows(table, count)
+    print(f"{count} rows of `{table}`, {len(schema[table]['columns'])} cols")
+
+    shape = row_shapes.compile_schema(schema)[table]
+    old_rows, old = run_bench("old", lambda r: old_prepare_row_data(r, table),
+                              rows)
+    new_rows, new = run_bench("compiled",
+                              lambda r: row_shapes.shape_rows(r, shape), rows)
+    print(f"speed-up: {old / new:.1f}x, same output: {old_rows == new_rows}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#! /usr/bin/python3
+""" in memory copies of small tables, used to satisfy joins """
+
+import threading
+import time
+
+import log_queue
+
+
+class JoinCache:
+    """ keep whole tables of up to {max_rows} rows for joining to """
+    def __init__(self, max_rows=5000):
+        self.max_rows = max_rows
+        self.tables = {}
+        self.counts = {"hits": 0, "misses": 0, "loads": 0}
+        self.lock = threading.Lock()
+
+    def configure(self, ttls):
+        """ cache the tables in {ttls}, each for its number of seconds """
+        with self.lock:
+            self.tables = {
+                table: {
+                    "ttl": int(ttls[table]),
+                    "expires": 0,
+                    "version": None,
+                    "rows": None,
+                    "index": {}
+                }
+                for table in ttls
+            }
+
+    def wanted(self, table):
+        """ is {table} one we cache """
+        return table in self.tables
+
+    def stale(self, table, version=None):
+        """ does {table} need (re)loading, e.g. as it is now at {version} """
+        with self.lock:
+            this_tbl = self.tables[table]
+            if this_tbl["ttl"] < 0:
+                return False
+            return (this_tbl["expires"] < time.monotonic()
+                    or version != this_tbl["version"])
+
+    def store(self, table, rows, version=None):
+        """ save MySQL {rows} as the contents of {table} at {version} """
+        with self.lock:
+            if table not in self.tables:
+                return
+            this_tbl = self.tables[table]
+            this_tbl["index"] = {}
+            this_tbl["version"] = version
+            this_tbl["expires"] = time.monotonic() + this_tbl["ttl"]
+            if len(rows) > self.max_rows:
+                log_queue.warning(f"Table '{table}' too big for join cache")
+                this_tbl["rows"] = None
+                this_tbl["ttl"] = -1
+                return
+            this_tbl["rows"] = rows
+            self.counts["loads"] += 1
+
+    def lookup(self, table, column, keys, wanted=None):
+        """ rows from {table} where {column} is in {keys}, or None
+            with only the {wanted} columns, if given """
+        with self.lock:
+            this_tbl = self.tables[table]
+            if this_tbl["rows"] is None:
+                self.counts["misses"] += 1
+                return None
+
+            if column not in this_tbl["index"]:
+                this_tbl["index"][column] = {
+                    row[column]: row
+                    for row in this_tbl["rows"] if column in row
+                }
+            index = this_tbl["index"][column]
+            self.counts["hits"] += 1
+
+        if wanted is None:
+            return {key: dict(index[key]) for key in keys if key in index}
+        return {
+            key: {col: index[key][col]
+                  for col in wanted if col in index[key]}
+            for key in keys if key in index
+        }
+
+    def invalidate(self, table):
+        """ {table} has changed, so reload it next time """
+        with self.lock:
+            if table in self.tables:
+                self.tables[table]["expires"] = 0
+
+    def stats(self):
+        """ current cache numbers """
+        with self.lock:
+            ret = {
+                "tables": {
+                    table: len(self.tables[table]["rows"])
+                    for table in self.tables
+                    if self.tables[table]["rows"] is not None
+                }
+            }
+            ret.update(self.counts)
+            return ret
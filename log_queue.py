@@ -0,0 +1,145 @@
+#! /usr/bin/python3
+""" levelled logging, handed to a background thread & written in batches,
+    so requests never wait for the log. Each line is prefixed with its
+    syslog priority, e.g. `<4>`, for `pylogger` to log it at that level """
+
+import atexit
+import os
+import queue
+import random
+import sys
+import threading
+
+LEVELS = {"debug": 7, "info": 6, "notice": 5, "warning": 4, "error": 3}
+
+settings = {
+    "level": LEVELS["info"],
+    "sql_chars": 500,
+    "sql_sample": 1.0,
+    "batch": 500
+}
+records = queue.Queue(maxsize=10000)
+writer = {"pid": None, "dropped": 0}
+lock = threading.Lock()
+
+
+def configure(level="info", sql_chars=500, sql_sample=1.0, batch=500):
+    """ only log {level} & above, SQL is cut to {sql_chars} & only a
+        {sql_sample} fraction of statements are logged """
+    if level not in LEVELS:
+        raise ValueError(f"Log level '{level}' is not supported")
+    settings["level"] = LEVELS[level]
+    settings["sql_chars"] = sql_chars
+    settings["sql_sample"] = sql_sample
+    settings["batch"] = batch
+
+
+def log(level, message, **fields):
+    """ queue {message} & any {fields} to be logged at {level} """
+    priority = LEVELS[level]
+    if priority > settings["level"]:
+        return
+
+    line = f"<{priority}>{level.upper()}: {message}"
+    if len(fields) > 0:
+        line += " " + " ".join(
+            [f"{key}={value}" for key, value in fields.items()])
+    start_writer()
+    try:
+        records.put_nowait(line.replace("\n", " ") + "\n")
+    except queue.Full:
+        with lock:
+            writer["dropped"] += 1
+
+
+def debug(message, **fields):
+    """ log {message} at `debug` """
+    log("debug", message, **fields)
+
+
+def info(message, **fields):
+    """ log {message} at `info` """
+    log("info", message, **fields)
+
+
+def warning(message, **fields):
+    """ log {message} at `warning` """
+    log("warning", message, **fields)
+
+
+def error(message, **fields):
+    """ log {message} at `error` """
+    log("error", message, **fields)
+
+
+def cut_sql(text):
+    """ SQL {text} cut short to the configured length """
+    if settings["sql_chars"] > 0 and len(text) > settings["sql_chars"]:
+        return text[:settings["sql_chars"]] + f"... [{len(text)} chars]"
+    return text
+
+
+def sql(text):
+    """ log SQL {text} at `info`, cut short & sampled as configured """
+    if LEVELS["info"] > settings["level"]:
+        return
+    if random.random() >= settings["sql_sample"]:
+        return
+    log("info", "SQL", sql=cut_sql(text))
+
+
+def take_batch(wait):
+    """ up to `batch` lines from the queue, waiting for the first if {wait} """
+    lines = []
+    try:
+        lines.append(records.get(block=wait))
+        while len(lines) < settings["batch"]:
+            lines.append(records.get_nowait())
+    except queue.Empty:
+        pass
+
+    with lock:
+        dropped = writer["dropped"]
+        writer["dropped"] = 0
+    if dropped > 0:
+        lines.append(f"<4>WARNING: Log queue full dropped={dropped}\n")
+    return lines
+
+
+def write_batch(lines):
+    """ write all the {lines} in one go """
+    if len(lines) <= 0:
+        return
+    try:
+        sys.stdout.write("".join(lines))
+        sys.stdout.flush()
+    except (OSError, ValueError):
+        pass
+
+
+def write_forever():
+    """ write batches of lines as they are queued """
+    while True:
+        write_batch(take_batch(True))
+
+
+def flush():
+    """ write all queued lines now """
+    lines = take_batch(False)
+    while len(lines) > 0:
+        write_batch(lines)
+        lines = take_batch(False)
+
+
+def start_writer():
+    """ start the writer thread, once in each process """
+    if writer["pid"] == os.getpid():
+        return
+    with lock:
+        if writer["pid"] == os.getpid():
+            return
+        writer["pid"] = os.getpid()
+        threading.Thread(target=write_forever, daemon=True).start()
+
+
+atexit.register(flush)
@@ -0,0 +1,226 @@
+#! /usr/bin/python3
+""" request counters & latency histograms, merged across worker processes
+    through files in a shared directory, output in Prometheus text format """
+
+import contextlib
+import copy
+import fcntl
+import json
+import os
+import threading
+import time
+
+ARCHIVE = "archive"
+
+BUCKETS = [
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+    5, 10
+]
+
+
+def label_text(labels):
+    """ Prometheus label string for the {labels} dict """
+    return ",".join([
+        key + '="' + str(labels[key]).replace("\\", "\\\\").replace(
+            '"', '\\"').replace("\n", "\\n") + '"'
+        for key in sorted(labels)
+    ])
+
+
+class Metrics:
+    """ counters, gauges & histograms for this process, saved every
+        {interval} secs to {directory}, if given, for other processes """
+    def __init__(self, directory=None, interval=5):
+        self.directory = directory
+        self.interval = interval
+        self.data = {"counter": {}, "gauge": {}, "histogram": {}}
+        self.lock = threading.Lock()
+        self.saver = None
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def count(self, name, amount=1, **labels):
+        """ add {amount} to counter {name} """
+        key = label_text(labels)
+        with self.lock:
+            values = self.data["counter"].setdefault(name, {})
+            values[key] = values.get(key, 0) + amount
+
+    def set(self, kind, name, value, **labels):
+        """ set {kind} (counter or gauge) {name} to {value} """
+        with self.lock:
+            self.data[kind].setdefault(name, {})[label_text(labels)] = value
+
+    def observe(self, name, secs, **labels):
+        """ add {secs} to histogram {name} """
+        key = label_text(labels)
+        pos = 0
+        while pos < len(BUCKETS) and secs > BUCKETS[pos]:
+            pos += 1
+        with self.lock:
+            values = self.data["histogram"].setdefault(name, {})
+            if key not in values:
+                values[key] = {
+                    "buckets": [0] * (len(BUCKETS) + 1),
+                    "sum": 0,
+                    "count": 0
+                }
+            values[key]["buckets"][pos] += 1
+            values[key]["sum"] += secs
+            values[key]["count"] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """ add the time the block takes to histogram {name} """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """ copy of this process's numbers """
+        with self.lock:
+            return copy.deepcopy(self.data)
+
+    def start(self, collect):
+        """ save every {interval} secs, calling {collect} first """
+        if self.directory is None or self.saver is not None:
+            return
+
+        def save_forever():
+            while True:
+                time.sleep(self.interval)
+                collect()
+                self.save()
+
+        self.saver = threading.Thread(target=save_forever, daemon=True)
+        self.saver.start()
+
+    def save(self):
+        """ write this process's numbers for the other processes to see """
+        if self.directory is None:
+            return
+        file = os.path.join(self.directory, f"{os.getpid()}.json")
+        try:
+            with open(file + ".tmp", "w") as fd:
+                json.dump(self.snapshot(), fd)
+            os.replace(file + ".tmp", file)
+        except OSError:
+            pass
+
+    def merged(self):
+        """ this process's numbers added to those saved by the others """
+        ret = self.snapshot()
+        if self.directory is None:
+            return ret
+
+        for file in os.listdir(self.directory):
+            pid = file[:-5]
+            if (not file.endswith(".json") or not pid.isdigit()
+                    or int(pid) == os.getpid()):
+                continue
+            path = os.path.join(self.directory, file)
+            if not process_running(int(pid)):
+                self.archive(path)
+                continue
+            add_data(ret, read_data(path))
+
+        add_data(ret,
+                 read_data(os.path.join(self.directory, ARCHIVE + ".json")))
+        return ret
+
+    def archive(self, path):
+        """ add the counters & histograms in {path}, saved by a process
+            that has gone, to the archive, so the totals never go down """
+        claimed = f"{path}.{os.getpid()}.gone"
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return
+        data = read_data(claimed)
+        with contextlib.suppress(OSError):
+            os.remove(claimed)
+        data["gauge"] = {}
+
+        file = os.path.join(self.directory, ARCHIVE)
+        try:
+            with open(file + ".lock", "w") as lock_fd:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                total = {"counter": {}, "gauge": {}, "histogram": {}}
+                add_data(total, read_data(file + ".json"))
+                add_data(total, data)
+                with open(file + ".tmp", "w") as fd:
+                    json.dump(total, fd)
+                os.replace(file + ".tmp", file + ".json")
+        except OSError:
+            pass
+
+
+def read_data(path):
+    """ numbers saved in {path}, or none if it can not be read """
+    try:
+        with open(path, "r") as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+
+def process_running(pid):
+    """ is process {pid} still running """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def add_data(total, data):
+    """ add the numbers in {data} to those in {total} """
+    for kind in total:
+        for name, values in data.get(kind, {}).items():
+            into = total[kind].setdefault(name, {})
+            for key, value in values.items():
+                if key not in into:
+                    into[key] = value
+                elif kind == "histogram":
+                    into[key]["buckets"] = [
+                        num + add
+                        for num, add in zip(into[key]["buckets"],
+                                            value["buckets"])
+                    ]
+                    into[key]["sum"] += value["sum"]
+                    into[key]["count"] += value["count"]
+                else:
+                    into[key] += value
+
+
+def series(name, key, extra=""):
+    """ Prometheus series {name} with label string {key} & label {extra} """
+    key = ",".join([text for text in [key, extra] if len(text) > 0])
+    return name + ("{" + key + "}" if len(key) > 0 else "")
+
+
+def prometheus_text(data):
+    """ the numbers in {data} in Prometheus text format """
+    lines = []
+    for kind in ["counter", "gauge"]:
+        for name in sorted(data[kind]):
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(data[kind][name].items()):
+                lines.append(f"{series(name, key)} {value}")
+
+    for name in sorted(data["histogram"]):
+        lines.append(f"# TYPE {name} histogram")
+        for key, value in sorted(data["histogram"][name].items()):
+            total = 0
+            for limit, num in zip(BUCKETS + ["+Inf"], value["buckets"]):
+                total += num
+                bucket = series(name + "_bucket", key, f'le="{limit}"')
+                lines.append(f"{bucket} {total}")
+            lines.append(f"{series(name + '_sum', key)} {value['sum']}")
+            lines.append(f"{series(name + '_count', key)} {value['count']}")
+
+    return "\n".join(lines) + "\n"
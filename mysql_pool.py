@@ -0,0 +1,166 @@
+#! /usr/bin/python3
+""" pool of MySQL connections with health checks & bounded reconnects """
+
+import contextlib
+import threading
+import time
+import MySQLdb
+
+
+class PoolTimeout(MySQLdb.OperationalError):
+    """ no connection became free in time """
+
+
+class ConnectionPool:
+    """ hand out up to {size} connections made by calling {connect} """
+    def __init__(self,
+                 connect,
+                 size=2,
+                 idle_ping=30,
+                 max_lifetime=3600,
+                 max_backoff=30,
+                 wait=10):
+        self.connect = connect
+        self.size = size
+        self.idle_ping = idle_ping
+        self.max_lifetime = max_lifetime
+        self.max_backoff = max_backoff
+        self.wait = wait
+        self.idle = []
+        self.born = {}
+        self.in_use = 0
+        self.fails = 0
+        self.reconnects = 0
+        self.timeouts = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, wait=None):
+        """ take a healthy connection from the pool, or make a new one,
+            waiting up to {wait} secs (default `wait`) for one to be free """
+        give_up = time.monotonic() + (self.wait if wait is None else wait)
+        with self.cond:
+            while len(self.idle) <= 0 and self.in_use >= self.size:
+                left = give_up - time.monotonic()
+                if left <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        2000, "No MySQL connection became free in time")
+                self.cond.wait(left)
+            self.in_use += 1
+            item = self.idle.pop() if len(self.idle) > 0 else None
+
+        try:
+            cnx = self.check_idle(item)
+            if cnx is None:
+                cnx = self.new_connection()
+        except Exception:
+            with self.cond:
+                self.in_use -= 1
+                self.cond.notify()
+            raise
+
+        return cnx
+
+    def release(self, cnx):
+        """ give {cnx} back to the pool for reuse """
+        with self.cond:
+            self.in_use -= 1
+            self.idle.append((cnx, time.monotonic()))
+            self.cond.notify()
+
+    def discard(self, cnx):
+        """ close {cnx} & free its slot, e.g. after it has failed """
+        self.close_quietly(cnx)
+        with self.cond:
+            self.in_use -= 1
+            self.cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """ context manager to borrow a connection """
+        cnx = self.acquire()
+        try:
+            yield cnx
+        except MySQLdb.OperationalError:
+            self.discard(cnx)
+            raise
+        except BaseException:
+            self.release(cnx)
+            raise
+        else:
+            self.release(cnx)
+
+    def close_all(self):
+        """ close all the idle connections """
+        with self.cond:
+            idle = self.idle
+            self.idle = []
+            self.born = {}
+        for cnx, __ in idle:
+            try:
+                cnx.close()
+            except MySQLdb.Error:
+                pass
+
+    def stats(self):
+        """ current pool numbers """
+        with self.cond:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.in_use,
+                "reconnects": self.reconnects,
+                "timeouts": self.timeouts
+            }
+
+    def check_idle(self, item):
+        """ return the connection in {item}, if it is still good to use """
+        if item is None:
+            return None
+
+        cnx, last_used = item
+        now = time.monotonic()
+        if now - self.born.get(id(cnx), now) > self.max_lifetime:
+            self.close_quietly(cnx)
+            return None
+
+        if now - last_used > self.idle_ping:
+            try:
+                cnx.ping()
+            except MySQLdb.Error:
+                self.close_quietly(cnx)
+                return None
+
+        return cnx
+
+    def new_connection(self):
+        """ connect to MySQL, backing off if recent attempts have failed """
+        with self.cond:
+            fails = self.fails
+        if fails > 0:
+            time.sleep(min(0.1 * (2**fails), self.max_backoff))
+
+        try:
+            cnx = self.connect()
+        except MySQLdb.Error:
+            cnx = None
+
+        with self.cond:
+            if cnx is None:
+                self.fails = min(self.fails + 1, 16)
+                raise MySQLdb.OperationalError(2003,
+                                               "Failed to connect to MySQL")
+            self.fails = 0
+            self.born[id(cnx)] = time.monotonic()
+
+        return cnx
+
+    def close_quietly(self, cnx):
+        """ close {cnx}, ignoring any errors, it will need replacing """
+        with self.cond:
+            self.born.pop(id(cnx), None)
+            self.reconnects += 1
+        try:
+            cnx.close()
+        except MySQLdb.Error:
+            pass
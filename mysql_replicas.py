@@ -0,0 +1,115 @@
+#! /usr/bin/python3
+""" read replicas of the MySQL server, each with its own connection pool,
+    only used while their replication lag is small enough """
+
+import threading
+import time
+import MySQLdb
+
+LAG_SQL = ["show replica status", "show slave status"]
+LAG_COLUMNS = ["Seconds_Behind_Source", "Seconds_Behind_Master"]
+
+
+class ReplicaSet:
+    """ pick from the {pools} of each replica in turn, skipping any more than
+        {max_lag} secs behind, checking each at most every {check_every} """
+    def __init__(self, pools, max_lag=5, check_every=5):
+        self.pools = pools
+        self.names = list(pools)
+        self.max_lag = max_lag
+        self.check_every = check_every
+        self.state = {
+            name: {
+                "checked": None,
+                "usable": False,
+                "reads": 0
+            }
+            for name in self.names
+        }
+        self.turn = 0
+        self.fallbacks = 0
+        self.lock = threading.Lock()
+
+    def pick(self):
+        """ pool of a usable replica, or None if the primary must be used """
+        with self.lock:
+            start = self.turn
+            self.turn = (self.turn + 1) % len(self.names)
+
+        for pos in range(len(self.names)):
+            name = self.names[(start + pos) % len(self.names)]
+            if self.usable(name):
+                with self.lock:
+                    self.state[name]["reads"] += 1
+                return self.pools[name]
+
+        with self.lock:
+            self.fallbacks += 1
+        return None
+
+    def usable(self, name):
+        """ is replica {name} up & close enough behind the primary """
+        now = time.monotonic()
+        with self.lock:
+            state = self.state[name]
+            if (state["checked"] is not None
+                    and state["checked"] > now - self.check_every):
+                return state["usable"]
+            state["checked"] = now
+
+        lag = self.read_lag(self.pools[name])
+        with self.lock:
+            state["usable"] = lag is not None and lag <= self.max_lag
+            return state["usable"]
+
+    def failed(self, failed_pool):
+        """ {failed_pool} could not connect, so stop using it for a while """
+        with self.lock:
+            for name in self.names:
+                if self.pools[name] is failed_pool:
+                    self.state[name]["checked"] = time.monotonic()
+                    self.state[name]["usable"] = False
+
+    def read_lag(self, replica_pool):
+        """ secs the replica of {replica_pool} is behind, None if not known """
+        try:
+            with replica_pool.connection() as cnx:
+                return replication_lag(cnx)
+        except MySQLdb.Error:
+            return None
+
+    def close_all(self):
+        """ close all the idle replica connections """
+        for replica_pool in self.pools.values():
+            replica_pool.close_all()
+
+    def stats(self):
+        """ current numbers """
+        with self.lock:
+            return {
+                "fallbacks": self.fallbacks,
+                "replicas": {
+                    name: {
+                        "reads": self.state[name]["reads"],
+                        "usable": self.state[name]["usable"]
+                    }
+                    for name in self.names
+                }
+            }
+
+
+def replication_lag(cnx):
+    """ secs the server of {cnx} is behind its source, None if stopped """
+    for sql in LAG_SQL:
+        try:
+            cnx.query(sql)
+        except MySQLdb.ProgrammingError:
+            continue
+        rows = cnx.store_result().fetch_row(maxrows=0, how=1)
+        if len(rows) <= 0:
+            return 0
+        for col in LAG_COLUMNS:
+            if col in rows[0]:
+                return None if rows[0][col] is None else int(rows[0][col])
+        return None
+    return None
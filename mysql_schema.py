@@ -1,12 +1,42 @@
 #! /usr/bin/python3
 """ provide a rest/api to a MySQL Database using Flask """
 
+import fcntl
 import json
 import os
+import time
+import zlib
 import yaml
 
+import log_queue
+
 INTS = ["tinyint", "int", "bigint"]
 
+COLUMNS_SQL = (
+    "select TABLE_NAME as `Table`,COLUMN_NAME as Field,COLUMN_TYPE as Type,"
+    "IS_NULLABLE as `Null`,COLUMN_DEFAULT as `Default`,EXTRA as Extra "
+    "from information_schema.COLUMNS where TABLE_SCHEMA=database()")
+
+INDEXES_SQL = (
+    "select TABLE_NAME as `Table`,INDEX_NAME as Key_name,"
+    "COLUMN_NAME as Column_name,NON_UNIQUE as Non_unique "
+    "from information_schema.STATISTICS where TABLE_SCHEMA=database() "
+    "order by TABLE_NAME,INDEX_NAME<>'PRIMARY',INDEX_NAME,SEQ_IN_INDEX")
+
+FINGERPRINT_SQL = (
+    "select (select concat(count(*),'/',ifnull(sum(crc32(concat_ws('|',"
+    "TABLE_NAME,COLUMN_NAME,COLUMN_TYPE,IS_NULLABLE,"
+    "ifnull(COLUMN_DEFAULT,'-'),EXTRA))),0)) from information_schema.COLUMNS "
+    "where TABLE_SCHEMA=database()) as cols,"
+    "(select concat(count(*),'/',ifnull(sum(crc32(concat_ws('|',"
+    "TABLE_NAME,INDEX_NAME,COLUMN_NAME,SEQ_IN_INDEX,NON_UNIQUE))),0)) "
+    "from information_schema.STATISTICS "
+    "where TABLE_SCHEMA=database()) as idxs")
+
+SNAPSHOT_VERSION = 1
+
+load_stats = {"tables": 0, "seconds": 0.0, "snapshot": False}
+
 
 def load_more_schema(new_schema):
     """ load users file of additional schema information """
@@ -40,16 +70,86 @@ def add_join_items(new_schema):
                     }
 
 
-def load_db_schema(cnx):
-    """ Load/Reload database schema """
+def load_db_schema(cnx, snapshot=None, refresh=False):
+    """ Load/Reload database schema, sharing it in the {snapshot} file """
     new_schema = {}
     load_more_schema(new_schema)
-    get_db_schema(cnx, new_schema)
+    if snapshot is None:
+        get_db_schema(cnx, new_schema)
+    else:
+        with open(snapshot + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            fingerprint = schema_fingerprint(cnx, new_schema)
+            if refresh or not read_snapshot(snapshot, fingerprint,
+                                            new_schema):
+                get_db_schema(cnx, new_schema)
+                write_snapshot(snapshot, fingerprint, new_schema)
+
     if ":more:" in new_schema and "joins" in new_schema[":more:"]:
         add_join_items(new_schema)
     return new_schema
 
 
+def schema_fingerprint(cnx, new_schema):
+    """ cheap checksum of the table definitions, to spot schema changes """
+    cnx.query(FINGERPRINT_SQL)
+    res = cnx.store_result()
+    ret = res.fetch_row(maxrows=1, how=1)[0]
+    is_boolean = []
+    if ":more:" in new_schema and "is_boolean" in new_schema[":more:"]:
+        is_boolean = new_schema[":more:"]["is_boolean"]
+    more_crc = zlib.crc32(json.dumps(is_boolean).encode("utf8"))
+    return as_text(ret["cols"]) + ";" + as_text(ret["idxs"]) + ";" + str(
+        more_crc)
+
+
+def read_snapshot(snapshot, fingerprint, new_schema):
+    """ load tables from {snapshot} into {new_schema}, if it is current """
+    load_stats["snapshot"] = False
+    if not os.path.isfile(snapshot):
+        return False
+    try:
+        with open(snapshot) as file:
+            saved = json.load(file)
+    except (OSError, ValueError):
+        return False
+
+    if (":snapshot:" not in saved
+            or saved[":snapshot:"]["version"] != SNAPSHOT_VERSION
+            or saved[":snapshot:"]["fingerprint"] != fingerprint):
+        return False
+
+    for table in saved:
+        if table[0] != ":":
+            new_schema[table] = saved[table]
+    load_stats["tables"] = len([t for t in new_schema if t[0] != ":"])
+    load_stats["snapshot"] = True
+    log_queue.info("Schema loaded from snapshot", snapshot=snapshot)
+    return True
+
+
+def write_snapshot(snapshot, fingerprint, new_schema):
+    """ save the tables in {new_schema} to {snapshot} for others to use """
+    saved = {
+        ":snapshot:": {
+            "version": SNAPSHOT_VERSION,
+            "fingerprint": fingerprint,
+            "when": int(time.time())
+        }
+    }
+    for table in new_schema:
+        if table[0] != ":":
+            saved[table] = new_schema[table]
+
+    tmp_file = snapshot + "." + str(os.getpid())
+    try:
+        with open(tmp_file, "w") as file:
+            json.dump(saved, file)
+        os.replace(tmp_file, snapshot)
+    except OSError as exc:
+        log_queue.error(f"Failed to save schema snapshot '{snapshot}': {exc}")
+
+
 def test_plain_int(this_type, this_places):
     """ return True if {this_type} with {this_places}
         # of decimal places is in INT """
@@ -71,14 +171,31 @@ def find_join_dest(table, col, jns):
 
 
 def sort_by_field(i):
-    """ return 'Field' item for sorting """
-    return i["Field"]
+    """ return 'Table' & 'Field' items for sorting """
+    return (i["Table"], i["Field"])
+
+
+def as_text(data):
+    """ MySQL returns some text as bytes, so convert {data} to a string """
+    if isinstance(data, bytes):
+        return data.decode("utf8")
+    return data
+
+
+def mariadb_default(col):
+    """ MariaDB quotes or gives `NULL` for {col} defaults, remove them """
+    defval = col["Default"]
+    if defval == "NULL":
+        return None
+    if len(defval) >= 2 and defval[0] == "'" and defval[-1] == "'":
+        return defval[1:-1].replace("''", "'")
+    return defval
 
 
 def schema_of_col(new_schema, col):
     """ convert MySQL column description into JSON schema """
     this_field = {}
-    this_type = col["Type"].decode("utf8")
+    this_type = col["Type"]
     this_places = 0
     if this_type.find(" unsigned") >= 0:
         this_type = this_type.split()[0]
@@ -117,51 +234,60 @@ def schema_of_col(new_schema, col):
             defval = int(defval)
         elif this_type == "boolean":
             defval = (int(defval) == 1)
-        else:
-            defval = defval.decode("utf8")
         this_field["default"] = defval
 
     return this_field
 
 
-def get_db_schema(cnx, new_schema):
-    """ Read schema from database """
-    cnx.query("show tables")
+def query_all_rows(cnx, sql):
+    """ run {sql} & return all rows, with all values as text """
+    cnx.query(sql)
     res = cnx.store_result()
-    ret = res.fetch_row(maxrows=0, how=1)
+    return [{key: as_text(row[key])
+             for key in row}
+            for row in res.fetch_row(maxrows=0, how=1)]
 
-    print(">> Loading schema:", os.environ["MYSQL_DATABASE"])
-    tbl_title = "Tables_in_" + os.environ["MYSQL_DATABASE"]
-    for table in ret:
-        new_schema[table[tbl_title]] = {}
 
-    for table in new_schema:
-        if table[0] == ":":
-            continue
+def get_db_schema(cnx, new_schema):
+    """ Read schema from database, using one query for all the tables """
+    log_queue.info("Loading schema", database=os.environ["MYSQL_DATABASE"])
+    start = time.monotonic()
+    is_mariadb = as_text(cnx.get_server_info()).find("MariaDB") >= 0
+
+    cols = query_all_rows(cnx, COLUMNS_SQL)
+    cols.sort(key=sort_by_field)
+    for col in cols:
+        table = col["Table"]
+        if table not in new_schema:
+            new_schema[table] = {"columns": {}}
+        if is_mariadb and col["Default"] is not None:
+            col["Default"] = mariadb_default(col)
+        new_schema[table]["columns"][col["Field"]] = schema_of_col(
+            new_schema, col)
 
-        cnx.query("describe " + table)
-        res = cnx.store_result()
-        ret = res.fetch_row(maxrows=0, how=1)
-        new_schema[table]["columns"] = {}
-        cols = [r for r in ret]
-        cols.sort(key=sort_by_field)
-        for col in cols:
-            new_schema[table]["columns"][col["Field"]] = schema_of_col(
-                new_schema, col)
-        add_indexes_to_schema(cnx, new_schema, table)
+    add_indexes_to_schema(cnx, new_schema)
+
+    load_stats["tables"] = len([t for t in new_schema if t[0] != ":"])
+    load_stats["seconds"] = time.monotonic() - start
+    log_queue.info("Schema loaded",
+                   tables=load_stats["tables"],
+                   secs=f"{load_stats['seconds']:.3f}")
     return new_schema
 
 
-def add_indexes_to_schema(cnx, new_schema, table):
-    """ Add index info for {table} to {new_schema} """
-    cnx.query("show index from " + table)
-    res = cnx.store_result()
-    ret = res.fetch_row(maxrows=0, how=1)
-    new_schema[table]["indexes"] = {}
-    for col in ret:
+def add_indexes_to_schema(cnx, new_schema):
+    """ Add index info for all tables to {new_schema} """
+    for table in new_schema:
+        if table[0] != ":":
+            new_schema[table]["indexes"] = {}
+
+    for col in query_all_rows(cnx, INDEXES_SQL):
+        if col["Table"] not in new_schema:
+            continue
+        indexes = new_schema[col["Table"]]["indexes"]
         key = col["Key_name"] if col["Key_name"] != "PRIMARY" else ":primary:"
-        if key not in new_schema[table]["indexes"]:
-            new_schema[table]["indexes"][key] = {}
-            new_schema[table]["indexes"][key]["columns"] = []
-        new_schema[table]["indexes"][key]["columns"].append(col["Column_name"])
-        new_schema[table]["indexes"][key]["unique"] = col["Non_unique"] == 0
+        if key not in indexes:
+            indexes[key] = {}
+            indexes[key]["columns"] = []
+        indexes[key]["columns"].append(col["Column_name"])
+        indexes[key]["unique"] = int(col["Non_unique"]) == 0
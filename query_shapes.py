@@ -0,0 +1,66 @@
+#! /usr/bin/python3
+""" bounded cache of compiled SQL templates, with a slot for each value """
+
+import collections
+import threading
+
+SLOT = "\0"
+
+
+class QueryShapes:
+    """ keep up to {max_entries} compiled templates """
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ return the template saved for {key}, or None """
+        with self.lock:
+            if key not in self.entries:
+                self.counts["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counts["hits"] += 1
+            return self.entries[key]
+
+    def put(self, key, template):
+        """ save {template} for {key} """
+        with self.lock:
+            self.entries[key] = template
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counts["evictions"] += 1
+
+    def clear(self):
+        """ drop all templates """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """ current cache numbers """
+        with self.lock:
+            ret = {"entries": len(self.entries)}
+            ret.update(self.counts)
+            return ret
+
+
+def make_template(sql, slots):
+    """ split {sql}, built with SLOT for each value, into a template
+        of the SQL between the values & the column of each of the {slots} """
+    parts = sql.split(SLOT)
+    if len(parts) != len(slots) + 1:
+        return None
+    return {"parts": parts, "slots": slots}
+
+
+def fill_template(template, values, add_data):
+    """ SQL from {template} with {values} converted by {add_data} """
+    parts = template["parts"]
+    sql = [parts[0]]
+    for this_col, data, part in zip(template["slots"], values, parts[1:]):
+        sql.append(add_data(data, this_col))
+        sql.append(part)
+    return "".join(sql)
@@ -0,0 +1,82 @@
+#! /usr/bin/python3
+""" bounded LRU cache of query results, with TTL & per-table invalidation """
+
+import collections
+import threading
+import time
+
+
+class ResultCache:
+    """ cache up to {max_entries} results, using up to {max_bytes} """
+    def __init__(self, max_entries=1000, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.counts = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations": 0
+        }
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ return the result saved for {key}, or None """
+        with self.lock:
+            if key not in self.entries:
+                self.counts["misses"] += 1
+                return None
+
+            expires, __, value = self.entries[key]
+            if expires < time.monotonic():
+                self.remove(key)
+                self.counts["misses"] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.counts["hits"] += 1
+            return value
+
+    def put(self, key, value, tables, ttl):
+        """ save {value} for {key} for {ttl} secs, it came from {tables} """
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (time.monotonic() + ttl, tables, value)
+            self.size += len(value)
+            while (len(self.entries) > self.max_entries
+                   or self.size > self.max_bytes):
+                self.remove(next(iter(self.entries)))
+                self.counts["evictions"] += 1
+
+    def invalidate(self, table):
+        """ drop all results that used data from {table} """
+        with self.lock:
+            drop = [
+                key for key in self.entries
+                if table in self.entries[key][1]
+            ]
+            for key in drop:
+                self.remove(key)
+            self.counts["invalidations"] += len(drop)
+
+    def clear(self):
+        """ drop all results """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """ current cache numbers """
+        with self.lock:
+            ret = {"entries": len(self.entries), "bytes": self.size}
+            ret.update(self.counts)
+            return ret
+
+    def remove(self, key):
+        """ remove {key}, lock must already be held """
+        self.size -= len(self.entries[key][2])
+        del self.entries[key]
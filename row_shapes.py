@@ -0,0 +1,93 @@
+#! /usr/bin/python3
+""" per-table column converters, compiled from the schema, to format rows """
+
+from datetime import datetime
+
+
+def to_boolean(data):
+    """ MySQL boolean {data} to JSON """
+    return int(data) != 0
+
+
+def to_text(data):
+    """ MySQL datetime & other {data} to a JSON string """
+    if isinstance(data, datetime):
+        return data.isoformat(" ", "seconds")
+    if not isinstance(data, str):
+        return str(data)
+    return data
+
+
+def column_converter(this_col, typed):
+    """ pick the function that will format data from {this_col}, None if
+        it can be used as is. {typed} output takes datetime & Decimal """
+    if this_col["type"] == "boolean":
+        return to_boolean
+    if this_col["type"] == "decimal":
+        return None if typed else float
+    if this_col["is_plain_int"]:
+        return int
+    if typed and this_col["type"] in ("datetime", "timestamp", "date"):
+        return None
+    return to_text
+
+
+def compile_schema(schema, typed=False):
+    """ make a converter & enum map for every column in {schema} """
+    enums = {}
+    if ":more:" in schema and "enums" in schema[":more:"]:
+        enums = schema[":more:"]["enums"]
+
+    shapes = {}
+    for table in schema:
+        if table[0] == ":":
+            continue
+        shapes[table] = {
+            col: (column_converter(this_col, typed), enums.get(col, None))
+            for col, this_col in schema[table]["columns"].items()
+        }
+    return shapes
+
+
+def column_plan(row, shape):
+    """ list of (column, converter, enums) for columns in {row} """
+    return [(col, ) + shape[col] if col in shape else (col, None, None)
+            for col in row]
+
+
+def shape_rows(rows, shape):
+    """ JSON format the {rows}, in place, using {shape} from one table """
+    if len(rows) <= 0:
+        return
+    plan = column_plan(rows[0], shape)
+    for pos, row in enumerate(rows):
+        new_row = {}
+        for col, convert, enums in plan:
+            data = row[col]
+            if data is None:
+                continue
+            if convert is not None:
+                data = convert(data)
+            if enums is not None and data in enums:
+                data = {":value:": data, ":text:": enums[data]}
+            new_row[col] = data
+        rows[pos] = new_row
+
+
+def shape_columns(rows, shape):
+    """ JSON format {rows} from one table as a list of column names &
+        a list of values for each row, keeping NULLs & not adding enums """
+    if len(rows) <= 0:
+        return [], []
+    plan = column_plan(rows[0], shape)
+    columns = [col for col, __, __ in plan]
+    values = []
+    for row in rows:
+        new_row = []
+        for col, convert, __ in plan:
+            data = row[col]
+            if data is not None and convert is not None:
+                data = convert(data)
+            new_row.append(data)
+        values.append(new_row)
+    return columns, values
@@ -0,0 +1,87 @@
+#! /usr/bin/python3
+""" serialise responses as JSON, MessagePack or CBOR, picked by `Accept` """
+
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+def json_dumps(data):
+    """ JSON encode {data}, using `orjson` if it is installed """
+    if orjson is not None:
+        return orjson.dumps(data,
+                            default=str,
+                            option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=str).encode("utf8")
+
+
+def msgpack_default(data):
+    """ MessagePack encode types it does not know about natively """
+    if isinstance(data, datetime):
+        if data.tzinfo is None:
+            data = data.replace(tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(data)
+    if isinstance(data, date):
+        return data.isoformat()
+    if isinstance(data, Decimal):
+        return str(data)
+    return str(data)
+
+
+def msgpack_dumps(data):
+    """ MessagePack encode {data} """
+    return msgpack.packb(data, default=msgpack_default, use_bin_type=True)
+
+
+def cbor_default(encoder, data):
+    """ CBOR encode types it does not know about natively """
+    encoder.encode(str(data))
+
+
+def cbor_dumps(data):
+    """ CBOR encode {data}, naive datetimes are taken to be UTC """
+    return cbor2.dumps(data, timezone=timezone.utc, default=cbor_default)
+
+
+FORMATS = {
+    "application/json": {
+        "name": "json",
+        "dumps": json_dumps,
+        "typed": False
+    }
+}
+
+if msgpack is not None:
+    FORMATS["application/msgpack"] = {
+        "name": "msgpack",
+        "dumps": msgpack_dumps,
+        "typed": True
+    }
+    FORMATS["application/x-msgpack"] = FORMATS["application/msgpack"]
+
+if cbor2 is not None:
+    FORMATS["application/cbor"] = {
+        "name": "cbor",
+        "dumps": cbor_dumps,
+        "typed": True
+    }
+
+
+def negotiate(accept):
+    """ pick the mime type to reply with from the `Accept` list {accept} """
+    return accept.best_match(list(FORMATS), default="application/json")
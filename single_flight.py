@@ -0,0 +1,178 @@
+#! /usr/bin/python3
+""" collapse identical requests made at the same time into one, that the
+    others wait for & share the result of, in this process or, if given a
+    {directory}, in every process on this host """
+
+import fcntl
+import hashlib
+import os
+import threading
+import time
+
+CLEAN_EVERY = 60
+
+
+class SingleFlight:
+    """ run each key once at a time, others wait up to {wait} secs for it """
+    def __init__(self, directory=None, wait=5):
+        self.directory = directory
+        self.wait = wait
+        self.flights = {}
+        self.counts = {"leaders": 0, "process": 0, "host": 0}
+        self.cleaned = time.monotonic()
+        self.lock = threading.Lock()
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def run(self, key, func):
+        """ return the bytes {func} returns, shared with others asking
+            for the same {key} at the same time """
+        with self.lock:
+            flight = self.flights.get(key, None)
+            leader = flight is None
+            if leader:
+                flight = {"done": threading.Event(), "result": None}
+                self.flights[key] = flight
+
+        if not leader:
+            if flight["done"].wait(self.wait) and flight["result"] is not None:
+                self.count("process")
+                return flight["result"]
+            return func()
+
+        try:
+            flight["result"] = self.run_on_host(key, func)
+            return flight["result"]
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight["done"].set()
+
+    def run_on_host(self, key, func):
+        """ run {func}, unless another process is already running {key} """
+        if self.directory is None:
+            self.count("leaders")
+            return func()
+
+        path = os.path.join(self.directory,
+                            hashlib.sha1(key.encode("utf8")).hexdigest())
+        started = time.time_ns()
+        try:
+            fd, locked, waited = self.open_locked(path + ".lock")
+        except OSError:
+            self.count("leaders")
+            return func()
+
+        try:
+            if not locked:
+                self.count("leaders")
+                return func()
+            if waited:
+                shared = read_result(path, started)
+                if shared is not None:
+                    self.count("host")
+                    return shared
+
+            self.count("leaders")
+            result = func()
+            save_result(path, result)
+            self.clean_up()
+            return result
+        finally:
+            os.close(fd)
+
+    def open_locked(self, lock_file):
+        """ open & lock {lock_file}, trying again if it was removed by
+            `clean_up` while waiting, return the fd, if it was locked &
+            if another process had it locked first """
+        while True:
+            fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+            locked, waited = self.wait_for_lock(fd)
+            try:
+                same = os.stat(lock_file).st_ino == os.fstat(fd).st_ino
+            except OSError:
+                same = False
+            if not locked or same:
+                return fd, locked, waited
+            os.close(fd)
+
+    def wait_for_lock(self, fd):
+        """ lock {fd}, giving up after `wait` secs, return if it was
+            locked & if another process had it locked first """
+        waited = False
+        give_up = time.monotonic() + self.wait
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True, waited
+            except BlockingIOError:
+                waited = True
+                if time.monotonic() > give_up:
+                    return False, waited
+                time.sleep(0.002)
+
+    def clean_up(self):
+        """ remove old files, no more than every CLEAN_EVERY secs """
+        with self.lock:
+            if self.cleaned > time.monotonic() - CLEAN_EVERY:
+                return
+            self.cleaned = time.monotonic()
+
+        too_old = time.time() - CLEAN_EVERY
+        for file in os.listdir(self.directory):
+            path = os.path.join(self.directory, file)
+            try:
+                if os.stat(path).st_mtime >= too_old:
+                    continue
+                if file.endswith(".lock"):
+                    remove_unlocked(path)
+                else:
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def count(self, what):
+        """ add one to the {what} count """
+        with self.lock:
+            self.counts[what] += 1
+
+    def stats(self):
+        """ current numbers """
+        with self.lock:
+            return dict(self.counts)
+
+
+def remove_unlocked(lock_file):
+    """ remove {lock_file}, unless a process has it locked """
+    fd = os.open(lock_file, os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return
+    try:
+        os.remove(lock_file)
+    finally:
+        os.close(fd)
+
+
+def read_result(path, started):
+    """ result saved to {path} since {started}, or None """
+    try:
+        with open(path + ".data", "rb") as fd:
+            if os.fstat(fd.fileno()).st_mtime_ns < started:
+                return None
+            return fd.read()
+    except OSError:
+        return None
+
+
+def save_result(path, result):
+    """ save {result} to {path} for other processes to read """
+    tmp_file = path + "." + str(os.getpid())
+    try:
+        with open(tmp_file, "wb") as fd:
+            fd.write(result)
+        os.replace(tmp_file, path + ".data")
+    except OSError:
+        pass
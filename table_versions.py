@@ -0,0 +1,84 @@
+#! /usr/bin/python3
+""" per-table change versions, shared between processes by the `stat` of a
+    file for each table, which is appended to every time the table changes """
+
+import os
+import threading
+import time
+
+MAX_FILE_SIZE = 1024 * 1024
+
+
+class TableVersions:
+    """ versions of each table, in {directory} if given, else in memory """
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.local = {}
+        self.changed = {}
+        self.update_times = {}
+        self.lock = threading.Lock()
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def bump(self, table):
+        """ {table} has changed, so give it a new version """
+        with self.lock:
+            self.changed[table] = time.time()
+        if self.directory is None:
+            with self.lock:
+                self.local[table] = self.local.get(table, 0) + 1
+            return
+
+        path = os.path.join(self.directory, table)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                if os.fstat(fd).st_size >= MAX_FILE_SIZE:
+                    os.ftruncate(fd, 0)
+                os.write(fd, b".")
+            finally:
+                os.close(fd)
+        except OSError:
+            with self.lock:
+                self.local[table] = self.local.get(table, 0) + 1
+
+    def version(self, table):
+        """ current version of {table} """
+        with self.lock:
+            ret = str(self.local.get(table, 0))
+        if self.directory is None:
+            return ret
+        try:
+            stat = os.stat(os.path.join(self.directory, table))
+        except OSError:
+            return ret
+        return f"{ret}.{stat.st_mtime_ns}.{stat.st_size}"
+
+    def changed_at(self, table):
+        """ time {table} last changed, or 0 if not known """
+        with self.lock:
+            ret = self.changed.get(table, 0)
+        if self.directory is None:
+            return ret
+        try:
+            stat = os.stat(os.path.join(self.directory, table))
+        except OSError:
+            return ret
+        return max(ret, stat.st_mtime)
+
+    def mysql_times(self, tables, secs, read):
+        """ MySQL's update time of each of {tables}, calling {read} with
+            those not checked in the last {secs} secs """
+        now = time.monotonic()
+        with self.lock:
+            due = [
+                table for table in tables if table not in self.update_times
+                or self.update_times[table][0] < now - secs
+            ]
+        if len(due) > 0:
+            found = read(due)
+            with self.lock:
+                for table in due:
+                    self.update_times[table] = (now, found.get(table, None))
+        with self.lock:
+            return [self.update_times[table][1] for table in tables]